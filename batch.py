@@ -0,0 +1,186 @@
+"""
+批量生成日历：
+读取一个目录（每个 *.json 文件一份课表，或由 compiled.py 预编译的 *.ttc 文件）或一个 JSONL 文件（每行一份课表），
+在进程池中逐份编译为 .ics 文件。
+
+每份课表的格式：
+{
+  "name": "2023001",                     # 输出文件名（可选，默认为文件名或行号）
+  "school": "uestc" 或 {...},             # 学校设置：设置文件中的键名，或直接内联
+  "courses": [...],                       # json_to_courses 格式的课程列表
+  "adjustments": {...}                    # 调休数据（可选）
+}
+学校设置的格式：
+{"duration": 45, "timetable": [[8, 0], [8, 50], ...], "start": [2025, 2, 24], "adjustments": {...}, "compact": false,
+ "timezone": "Asia/Shanghai"}   # timezone 可为 IANA 时区名、"UTC" 或 "floating"（浮动时间）
+
+用法：
+python batch.py timetables.jsonl -o output --schools schools.json
+"""
+import argparse
+import json
+import os
+import time
+from pathlib import Path
+from typing import Any, Iterator, Optional
+
+import compiled
+from data import School
+from parserics.json_to_courses import json_to_courses
+
+
+def load_definitions(source: str) -> Iterator[tuple[str, Any]]:
+    """
+    逐份读取课表定义，产出 (名称, 定义)；
+    单份定义无法解析为 JSON 时产出 (名称, 异常)，由调用方记为失败而不中断整批任务；
+    预编译的 .ttc 文件产出 (名称, 文件路径)，由工作进程直接 mmap 读取
+    """
+    path = Path(source)
+    if path.is_dir():
+        for file in sorted(path.glob("*.json")):
+            try:
+                yield file.stem, json.loads(file.read_text(encoding="utf-8"))
+            except ValueError as e:
+                yield file.stem, e
+        for file in sorted(path.glob("*.ttc")):
+            yield file.stem, file
+        return
+    with open(path, encoding="utf-8") as f:
+        for lineno, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                yield str(lineno), json.loads(line)
+            except ValueError as e:
+                yield str(lineno), e
+
+
+def build_school(definition: dict, schools: dict) -> School:
+    """
+    由单份课表定义与学校设置构建 School
+    """
+    settings = definition.get("school", {})
+    if isinstance(settings, str):
+        if settings not in schools:
+            raise ValueError(f"未找到学校设置：{settings}")
+        settings = schools[settings]
+    return School(
+        duration=settings.get("duration", 45),
+        timetable=[tuple(t) for t in settings["timetable"]],
+        start=tuple(settings["start"]),
+        courses=json_to_courses(definition["courses"], len(settings["timetable"])),
+        adjustments=definition.get("adjustments", settings.get("adjustments", {})),
+        compact=settings.get("compact", False),
+        timezone=settings.get("timezone", "Asia/Shanghai"),
+    )
+
+
+def output_name(name: str, definition: Any) -> str:
+    """
+    输出文件名（不含扩展名）：取定义中的 name，缺省为文件名或行号；
+    含路径分隔符、为空或为 . / .. 时抛出 ValueError，避免写到输出目录之外
+    """
+    if isinstance(definition, dict):
+        name = str(definition.get("name", name))
+    if name in ("", ".", "..") or any(c in name for c in ("/", "\\", "\0")):
+        raise ValueError(f"输出文件名无效：{name!r}")
+    return name
+
+
+def unique_names(definitions: Iterator[tuple[str, Any]]) -> Iterator[tuple[str, Any]]:
+    """
+    将 load_definitions 的名称替换为输出文件名；文件名无效或与前面的课表重复时，
+    定义替换为对应的 ValueError，由调用方记为该份课表的失败
+    """
+    seen = set()
+    for name, definition in definitions:
+        if isinstance(definition, Exception):
+            yield name, definition
+            continue
+        try:
+            name = output_name(name, definition)
+        except ValueError as e:
+            yield name, e
+            continue
+        if name in seen:
+            yield name, ValueError(f"输出文件名与前面的课表重复：{name}")
+            continue
+        seen.add(name)
+        yield name, definition
+
+
+# 工作进程中的学校设置，由进程池的 initializer 在每个进程启动时设置一次，不随每个任务重复传输
+_schools: dict = {}
+
+
+def _init_worker(schools: dict) -> None:
+    global _schools
+    _schools = schools
+
+
+def compile_one(task: tuple[str, Any, str]) -> tuple[str, Optional[str]]:
+    """
+    进程池任务：编译一份课表并直接写入输出目录，name 为已校验的输出文件名；
+    返回 (名称, 错误信息)，成功时错误信息为 None
+    """
+    name, definition, output = task
+    if isinstance(definition, json.JSONDecodeError):
+        return name, f"JSON 解析失败：{definition}"
+    if isinstance(definition, Exception):
+        return name, f"{type(definition).__name__}: {definition}"
+    try:
+        if isinstance(definition, Path):
+            school = compiled.load(str(definition))
+        else:
+            school = build_school(definition, _schools)
+        with open(os.path.join(output, f"{name}.ics"), "w", encoding="utf-8") as w:
+            school.write(w)
+    except Exception as e:
+        return name, f"{type(e).__name__}: {e}"
+    return name, None
+
+
+def run(source: str, output: str, schools: Optional[dict] = None,
+        workers: Optional[int] = None, chunksize: int = 16) -> list[tuple[str, str]]:
+    """
+    批量编译，返回失败列表 [(名称, 错误信息)]
+    """
+    # 只在主进程中导入；工作进程与 main.py 导入 build_school 时不需要
+    from concurrent.futures import ProcessPoolExecutor
+
+    os.makedirs(output, exist_ok=True)
+    tasks = ((name, d, output) for name, d in unique_names(load_definitions(source)))
+    failures = []
+    total = 0
+    begin = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(schools or {},)) as pool:
+        for name, error in pool.map(compile_one, tasks, chunksize=chunksize):
+            total += 1
+            if error is not None:
+                failures.append((name, error))
+                print(f"[失败] {name}: {error}")
+    elapsed = time.perf_counter() - begin
+    done = total - len(failures)
+    rate = done / elapsed if elapsed > 0 else 0.0
+    print(f"完成 {done}/{total} 份日历，用时 {elapsed:.2f}s，{rate:.1f} calendars/sec")
+    return failures
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="批量将课表定义编译为 .ics 文件")
+    parser.add_argument("source", help="课表定义目录（*.json）或 JSONL 文件")
+    parser.add_argument("-o", "--output", default="output", help="输出目录")
+    parser.add_argument("--schools", help="学校设置 JSON 文件：{键名: 设置}")
+    parser.add_argument("-j", "--workers", type=int, default=None, help="进程数，默认为 CPU 核数")
+    parser.add_argument("--chunksize", type=int, default=16, help="每次分发给进程的课表份数")
+    args = parser.parse_args()
+    schools = {}
+    if args.schools:
+        with open(args.schools, encoding="utf-8") as f:
+            schools = json.load(f)
+    failures = run(args.source, args.output, schools, args.workers, args.chunksize)
+    raise SystemExit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
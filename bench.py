@@ -0,0 +1,263 @@
+"""
+性能基准：
+用合成的 School / Course 数据测量日历生成与解析流程的耗时、吞吐量和峰值内存，
+结果保存为 JSON 基线，可用 compare 命令比较两次结果，按 events/sec 与峰值内存设置回归门限。
+
+用法：
+python bench.py run -o baseline.json            # 完整基准（最多 10k 门课程）
+python bench.py run --quick -o current.json     # 快速基准
+python bench.py compare baseline.json current.json --threshold 0.1
+"""
+import argparse
+import gc
+import json
+import platform
+import random
+import sys
+import time
+import tracemalloc
+import types
+from datetime import date, timedelta
+from typing import Callable, Optional
+
+from data import Course, School
+from parserics.json_to_courses import json_to_courses
+
+TIMETABLE = [(8, 0), (8, 50), (10, 0), (10, 50), (13, 30), (14, 20),
+             (15, 30), (16, 20), (18, 30), (19, 20), (20, 10), (21, 0)]
+START = (2026, 3, 2)
+
+
+def make_records(courses: int, weeks: int, name_length: int = 8, seed: int = 0) -> list[dict]:
+    """
+    生成 json_to_courses 格式的合成课程记录
+    """
+    rng = random.Random(seed)
+    records = []
+    for i in range(courses):
+        first = rng.randint(1, len(TIMETABLE) - 1)
+        kind = rng.random()
+        if kind < 0.6:
+            week_list = Course.week(1, weeks)
+        elif kind < 0.8:
+            week_list = Course.odd_week(1, weeks)
+        else:
+            week_list = Course.even_week(1, weeks) or [weeks]
+        records.append({
+            "name": f"课程{i}" + "长" * max(0, name_length - len(str(i)) - 2),
+            "teacher": f"教师{i % 97}",
+            "classroom": f"教{i % 13}-{i % 300}",
+            "weekday": rng.randint(1, 7),
+            "weeks": week_list,
+            "indexes": [first, first + 1],
+        })
+    return records
+
+
+def make_adjustments(count: int, weeks: int, seed: int = 0) -> dict:
+    """
+    生成 count 个放假日期与 count // 2 组调课
+    """
+    if not count:
+        return {}
+    rng = random.Random(seed)
+    first = date(*START)
+    days = [first + timedelta(days=rng.randrange(weeks * 7)) for _ in range(count + count // 2 * 2)]
+    return {
+        "off_dates": [d.isoformat() for d in days[:count]],
+        "remap": [{"date": days[count + 2 * i].isoformat(), "from": days[count + 2 * i + 1].isoformat()}
+                  for i in range(count // 2)],
+    }
+
+
+def make_school(courses: int, weeks: int, adjustments: int = 0, name_length: int = 8,
+                compact: bool = False, seed: int = 0) -> School:
+    return School(
+        duration=45,
+        timetable=list(TIMETABLE),
+        start=START,
+        courses=json_to_courses(make_records(courses, weeks, name_length, seed)),
+        adjustments=make_adjustments(adjustments, weeks, seed),
+        compact=compact,
+    )
+
+
+class StubClient:
+    """
+    模拟 OpenAI 兼容客户端，直接返回给定内容，用于测量 LLM 返回值的 JSON 处理路径
+    """
+
+    def __init__(self, content: str) -> None:
+        self.content = content
+        self.chat = self
+        self.completions = self
+
+    def create(self, **kwargs):
+        message = types.SimpleNamespace(content=self.content)
+        return types.SimpleNamespace(choices=[types.SimpleNamespace(message=message)])
+
+
+def measure(func: Callable[[], int], repeat: int) -> dict:
+    """
+    func 返回本次处理的条目数（事件数 / 行数 / 课程数）；
+    耗时取 repeat 次中的最小值，峰值内存单独运行一次由 tracemalloc 统计
+    """
+    best = float("inf")
+    items = 0
+    for _ in range(repeat):
+        gc.collect()
+        begin = time.perf_counter()
+        items = func()
+        best = min(best, time.perf_counter() - begin)
+    gc.collect()
+    tracemalloc.start()
+    func()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        "seconds": best,
+        "items": items,
+        "items_per_sec": items / best if best > 0 else 0.0,
+        "peak_kib": peak / 1024,
+    }
+
+
+def bench_generate(courses: int, weeks: int, adjustments: int = 0, name_length: int = 8,
+                   compact: bool = False) -> Callable[[], int]:
+    school = make_school(courses, weeks, adjustments, name_length, compact)
+
+    def run() -> int:
+        events = 0
+        for line in school.iter_lines():
+            if line == "BEGIN:VEVENT":
+                events += 1
+        return events
+    return run
+
+
+def bench_json_to_courses(courses: int, weeks: int) -> Callable[[], int]:
+    records = make_records(courses, weeks)
+    return lambda: len(json_to_courses(records))
+
+
+def bench_fold(lines: int, length: int) -> Callable[[], int]:
+    text = [f"SUMMARY:{'长课程名称' * (length // 5)} - 教室" for _ in range(lines)]
+
+    def run() -> int:
+        folded = 0
+        for line in text:
+            for _ in School._fold(line):
+                folded += 1
+        return folded
+    return run
+
+
+def bench_llm_json(courses: int, weeks: int) -> Optional[Callable[[], int]]:
+    try:
+        from parserics.llm_parser import parse_timetable
+    except ImportError:
+        return None
+    client = StubClient(json.dumps({"courses": make_records(courses, weeks)}, ensure_ascii=False))
+
+    def run() -> int:
+        data = json.loads(parse_timetable("无法用规则解析的课表文本", "", client=client))
+        return len(json_to_courses(data["courses"]))
+    return run
+
+
+def cases(quick: bool) -> dict[str, Callable[[], Optional[Callable[[], int]]]]:
+    sizes = [1, 100, 1000] if quick else [1, 100, 1000, 10000]
+    result = {}
+    for n in sizes:
+        for weeks in (1, 16, 30):
+            result[f"generate/courses={n}/weeks={weeks}"] = (
+                lambda n=n, weeks=weeks: bench_generate(n, weeks))
+        result[f"generate_adjusted/courses={n}"] = lambda n=n: bench_generate(n, 20, adjustments=60)
+        result[f"generate_long_names/courses={n}"] = lambda n=n: bench_generate(n, 16, name_length=80)
+        result[f"generate_compact/courses={n}"] = lambda n=n: bench_generate(n, 20, adjustments=60, compact=True)
+        result[f"json_to_courses/courses={n}"] = lambda n=n: bench_json_to_courses(n, 16)
+        result[f"llm_json/courses={n}"] = lambda n=n: bench_llm_json(n, 16)
+    result["fold/lines=10000/len=200"] = lambda: bench_fold(10000, 200)
+    return result
+
+
+def run(quick: bool = False, repeat: int = 3, pattern: str = "") -> dict:
+    results = {}
+    for name, factory in cases(quick).items():
+        if pattern and pattern not in name:
+            continue
+        func = factory()
+        if func is None:
+            print(f"{name:<45} 跳过（缺少依赖）")
+            continue
+        results[name] = measure(func, repeat)
+        r = results[name]
+        print(f"{name:<45} {r['seconds'] * 1000:>10.2f} ms {r['items_per_sec']:>14.0f} items/s "
+              f"{r['peak_kib']:>10.0f} KiB")
+    return {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "quick": quick,
+            "repeat": repeat,
+            "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": results,
+    }
+
+
+def compare(old: dict, new: dict, threshold: float = 0.1) -> list[str]:
+    """
+    比较两次基准结果，返回超过门限的回归项：
+    吞吐量（items/sec）下降或峰值内存上升超过 threshold 比例即视为回归
+    """
+    regressions = []
+    print(f"{'case':<45} {'items/s':>22} {'peak KiB':>22}")
+    for name, after in new["results"].items():
+        before = old["results"].get(name)
+        if before is None:
+            print(f"{name:<45} {'(新增)':>22}")
+            continue
+        speed = after["items_per_sec"] / before["items_per_sec"] - 1 if before["items_per_sec"] else 0.0
+        memory = after["peak_kib"] / before["peak_kib"] - 1 if before["peak_kib"] else 0.0
+        flag = ""
+        if speed < -threshold or memory > threshold:
+            flag = "  <-- 回归"
+            regressions.append(name)
+        print(f"{name:<45} {after['items_per_sec']:>14.0f} {speed:>+7.1%} "
+              f"{after['peak_kib']:>14.0f} {memory:>+7.1%}{flag}")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="日历生成与解析流程的性能基准")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_run = sub.add_parser("run", help="运行基准并保存结果")
+    p_run.add_argument("-o", "--output", help="结果 JSON 文件")
+    p_run.add_argument("--quick", action="store_true", help="只运行较小规模的用例")
+    p_run.add_argument("--repeat", type=int, default=3, help="每个用例重复次数，取最快一次")
+    p_run.add_argument("-k", "--pattern", default="", help="只运行名称包含该字符串的用例")
+    p_cmp = sub.add_parser("compare", help="比较两次基准结果")
+    p_cmp.add_argument("baseline")
+    p_cmp.add_argument("current")
+    p_cmp.add_argument("--threshold", type=float, default=0.1, help="允许的回归比例")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        result = run(args.quick, args.repeat, args.pattern)
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as f:
+                json.dump(result, f, ensure_ascii=False, indent=2)
+        return
+    with open(args.baseline, encoding="utf-8") as f:
+        old = json.load(f)
+    with open(args.current, encoding="utf-8") as f:
+        new = json.load(f)
+    regressions = compare(old, new, args.threshold)
+    if regressions:
+        print(f"{len(regressions)} 项回归超过 {args.threshold:.0%}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+"""
+编译后的课表二进制格式（.ttc）：
+将已校验的 School（学校设置、课程、周次位图、节次时间表、编译后的调休规则）按列式布局写入一个文件，
+读取时按列一次性解码后重建 School，无需解析 JSON、也不重新编译调休数据；
+batch.py 与 serve.py 可直接读取目录中预编译的 .ttc 文件。
+
+布局（小端序，各段按 4 字节对齐）：
+    文件头            _HEADER
+    字符串表          偏移 u32 × (n+1)，UTF-8 数据
+    节次时间表        (时, 分) u8 × 2 × 节数
+    课程列            课程名 / 教师 / 教室 / 班级的字符串编号 u32 × 课程数，
+                      周次偏移 u32 × (课程数+1)，节次偏移 u32 × (课程数+1)，星期 u8，周次类型 u8
+    周次数据          类型 0 为位图（WeekSet.mask 的字节），类型 1 为逐周 u16 列表（保留重复周次）
+    节次数据          u16
+    调休              放假日期 u32（date.toordinal()），调课日期对 u32 × 2，错误信息的字符串编号 u32
+
+用法：
+python compiled.py timetables/ -o compiled/ --schools schools.json
+"""
+import argparse
+import mmap
+import os
+import struct
+from datetime import date
+from typing import Union
+
+from data import Adjustments, Course, School, WeekSet
+
+MAGIC = b"TTSC"
+VERSION = 1
+# magic, version, flags, duration, 年, 月, 日, 节数, 时区字符串编号, 字符串数, 字符串字节数,
+# 课程数, 周次字节数, 节次个数, 放假日期数, 调课数, 错误信息数
+_HEADER = struct.Struct("<4sHHHHBBHIIIIIIIII")
+_COMPACT = 1
+_WEEKS_MASK, _WEEKS_LIST = 0, 1
+
+
+def _pad(data: bytes) -> bytes:
+    return data + b"\0" * (-len(data) % 4)
+
+
+def _weeks(course: Course) -> tuple[int, bytes]:
+    weeks = course.weeks
+    if isinstance(weeks, list) and len(set(weeks)) != len(weeks):
+        return _WEEKS_LIST, struct.pack(f"<{len(weeks)}H", *weeks)
+    mask = weeks.mask if isinstance(weeks, WeekSet) else WeekSet(weeks).mask
+    return _WEEKS_MASK, mask.to_bytes((mask.bit_length() + 7) // 8, "little")
+
+
+def dumps(school: School) -> bytes:
+    """
+    将 School 编译为二进制；School 已在构建时完成校验，这里不再重复检查
+    """
+    strings: dict[str, int] = {}
+
+    def string(text: str) -> int:
+        return strings.setdefault(text, len(strings))
+
+    courses = school.courses
+    adjustments = school._adjustments
+    timezone = string(school.timezone)
+    columns = [[string(getattr(c, key)) for c in courses] for key in ("name", "teacher", "classroom", "group")]
+    errors = [string(e) for e in adjustments.errors]
+
+    weeks_data, weeks_offsets, kinds = bytearray(), [0], []
+    indexes, indexes_offsets = [], [0]
+    for c in courses:
+        kind, data = _weeks(c)
+        kinds.append(kind)
+        weeks_data += data
+        weeks_offsets.append(len(weeks_data))
+        indexes.extend(c.indexes)
+        indexes_offsets.append(len(indexes))
+
+    encoded = [s.encode() for s in strings]
+    string_offsets = [0]
+    for s in encoded:
+        string_offsets.append(string_offsets[-1] + len(s))
+    # School 构建时在节次表开头插入了占位的第 0 节
+    periods = school.timetable[1:]
+    off_dates = sorted(d.toordinal() for d in adjustments.off_dates)
+    remap = [d.toordinal() for pair in adjustments.remap for d in pair]
+    n = len(courses)
+    header = _HEADER.pack(
+        MAGIC, VERSION, _COMPACT if school.compact else 0, school.duration,
+        *school.start[:3], len(periods), timezone, len(encoded), string_offsets[-1],
+        n, len(weeks_data), len(indexes), len(off_dates), len(adjustments.remap), len(errors),
+    )
+    return b"".join([
+        header,
+        struct.pack(f"<{len(string_offsets)}I", *string_offsets),
+        _pad(b"".join(encoded)),
+        _pad(bytes(x for period in periods for x in period)),
+        *(struct.pack(f"<{n}I", *column) for column in columns),
+        struct.pack(f"<{n + 1}I", *weeks_offsets),
+        struct.pack(f"<{n + 1}I", *indexes_offsets),
+        _pad(bytes(c.weekday for c in courses)),
+        _pad(bytes(kinds)),
+        _pad(bytes(weeks_data)),
+        _pad(struct.pack(f"<{len(indexes)}H", *indexes)),
+        struct.pack(f"<{len(off_dates)}I", *off_dates),
+        struct.pack(f"<{len(remap)}I", *remap),
+        struct.pack(f"<{len(errors)}I", *errors),
+    ])
+
+
+def loads(buffer: Union[bytes, bytearray, memoryview, mmap.mmap]) -> School:
+    """
+    由二进制还原 School：各列以显式小端序（struct.unpack_from）整列读取，与主机字节序无关，
+    格式不符或版本不支持时抛出 ValueError
+    """
+    with memoryview(buffer) as view:
+        if len(view) < _HEADER.size:
+            raise ValueError("不是有效的课表编译文件")
+        (magic, version, flags, duration, year, month, day, n_periods, timezone, n_strings, strings_size,
+         n, weeks_size, n_indexes, n_off, n_remap, n_errors) = _HEADER.unpack_from(view)
+        if magic != MAGIC:
+            raise ValueError("不是有效的课表编译文件")
+        if version != VERSION:
+            raise ValueError(f"不支持的课表编译格式版本：{version}（当前为 {VERSION}）")
+        pos = _HEADER.size
+
+        def take(size: int) -> memoryview:
+            nonlocal pos
+            start, pos = pos, pos + size + (-size % 4)
+            if pos > len(view):
+                raise ValueError("课表编译文件已截断")
+            return view[start:start + size]
+
+        def ints(fmt: str, count: int) -> list[int]:
+            with take(count * struct.calcsize(fmt)) as part:
+                return list(struct.unpack_from(f"<{count}{fmt}", part))
+
+        string_offsets = ints("I", n_strings + 1)
+        with take(strings_size) as part:
+            blob = bytes(part)
+        strings = [blob[a:b].decode() for a, b in zip(string_offsets, string_offsets[1:])]
+        with take(2 * n_periods) as part:
+            raw = bytes(part)
+        periods = [(raw[i], raw[i + 1]) for i in range(0, len(raw), 2)]
+        names, teachers, classrooms, groups = (ints("I", n) for _ in range(4))
+        weeks_offsets = ints("I", n + 1)
+        indexes_offsets = ints("I", n + 1)
+        weekdays = ints("B", n)
+        kinds = ints("B", n)
+        with take(weeks_size) as part:
+            weeks_data = bytes(part)
+        indexes = ints("H", n_indexes)
+        off_dates = ints("I", n_off)
+        remap = ints("I", 2 * n_remap)
+        errors = ints("I", n_errors)
+
+    if max(names + teachers + classrooms + groups + errors + [timezone], default=0) >= n_strings:
+        raise ValueError("课表编译文件已损坏：字符串编号超出范围")
+    if not set(kinds) <= {_WEEKS_MASK, _WEEKS_LIST}:
+        raise ValueError("课表编译文件已损坏：未知的周次类型")
+    if (string_offsets[-1], weeks_offsets[-1], indexes_offsets[-1]) != (strings_size, weeks_size, n_indexes):
+        raise ValueError("课表编译文件已损坏：偏移与长度不符")
+    courses = []
+    for i in range(n):
+        data = weeks_data[weeks_offsets[i]:weeks_offsets[i + 1]]
+        if kinds[i] == _WEEKS_LIST:
+            weeks = list(struct.unpack(f"<{len(data) // 2}H", data))
+        else:
+            weeks = WeekSet.from_mask(int.from_bytes(data, "little"))
+        courses.append(Course(
+            name=strings[names[i]],
+            teacher=strings[teachers[i]],
+            classroom=strings[classrooms[i]],
+            weekday=weekdays[i],
+            weeks=weeks,
+            indexes=indexes[indexes_offsets[i]:indexes_offsets[i + 1]],
+            group=strings[groups[i]],
+        ))
+    adjustments = Adjustments(
+        frozenset(date.fromordinal(d) for d in off_dates),
+        tuple((date.fromordinal(a), date.fromordinal(b)) for a, b in zip(remap[::2], remap[1::2])),
+        tuple(strings[e] for e in errors),
+    )
+    return School(
+        duration=duration,
+        timetable=periods,
+        start=(year, month, day),
+        courses=courses,
+        adjustments=adjustments,
+        compact=bool(flags & _COMPACT),
+        timezone=strings[timezone],
+    )
+
+
+def dump(school: School, path: str) -> None:
+    with open(path, "wb") as f:
+        f.write(dumps(school))
+
+
+def load(path: str) -> School:
+    """
+    以 mmap 读取 .ttc 文件，省去一次整文件复制；各列仍会全部解码，并重建（校验）完整的 School
+    """
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            raise ValueError("不是有效的课表编译文件")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+            return loads(m)
+
+
+def main() -> None:
+    import json
+    from batch import build_school, load_definitions, unique_names
+
+    parser = argparse.ArgumentParser(description="将课表定义预编译为 .ttc 二进制文件")
+    parser.add_argument("source", help="课表定义目录（*.json）或 JSONL 文件")
+    parser.add_argument("-o", "--output", default="compiled", help="输出目录")
+    parser.add_argument("--schools", help="学校设置 JSON 文件：{键名: 设置}")
+    args = parser.parse_args()
+    schools = {}
+    if args.schools:
+        with open(args.schools, encoding="utf-8") as f:
+            schools = json.load(f)
+    os.makedirs(args.output, exist_ok=True)
+    failures = 0
+    # 跳过目录中已有的 .ttc 文件（如重复编译到同一目录），它们不参与重名检查
+    definitions = ((name, d) for name, d in load_definitions(args.source) if not isinstance(d, os.PathLike))
+    for name, definition in unique_names(definitions):
+        try:
+            if isinstance(definition, Exception):
+                raise definition
+            dump(build_school(definition, schools), os.path.join(args.output, f"{name}.ttc"))
+        except Exception as e:
+            failures += 1
+            print(f"[失败] {name}: {type(e).__name__}: {e}")
+    raise SystemExit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,150 @@
 import re
 from dataclasses import dataclass, field
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta, timezone
+from functools import lru_cache
 from hashlib import md5
-from typing import Any
+from itertools import chain
+from typing import Any, Iterable, Iterator, Optional, TextIO, Union
+
+import metrics
+
+
+class WeekSet:
+    """
+    以整数位图保存的周次集合：
+    第 n 周对应第 n 位，成员判断、并集、交集都是整数位运算，
+    内存占用与周数无关；可与 list[int] 一样作为 Course.weeks 使用
+    """
+    __slots__ = ("mask",)
+
+    _TOKEN = re.compile(r"第?(\d+)(?:\s*[-~～至]\s*(\d+))?\s*周?\s*[（(]?([单双])?[)）]?\s*周?")
+    _SEPARATORS = re.compile(r"[,，、;；\s]+")
+
+    def __init__(self, weeks: Iterable[int] = ()) -> None:
+        mask = 0
+        for w in weeks:
+            if w < 0:
+                raise ValueError(f"周次 {w} 不能为负数")
+            mask |= 1 << w
+        self.mask = mask
+
+    @classmethod
+    def from_mask(cls, mask: int) -> "WeekSet":
+        ws = cls()
+        ws.mask = mask
+        return ws
+
+    @classmethod
+    def range(cls, start: int, end: int, parity: Optional[str] = None) -> "WeekSet":
+        """
+        返回 start 至 end 周（含）的集合，parity 为 "单" / "双" 时只保留奇数 / 偶数周：
+        如 WeekSet.range(2, 16, "双") -> 2-16双
+        """
+        if start < 0:
+            raise ValueError(f"周次 {start} 不能为负数")
+        if end < start:
+            return cls()
+        mask = ((1 << (end + 1)) - 1) ^ ((1 << start) - 1)
+        if parity == "单":
+            mask &= int("10" * (end // 2 + 1), 2)
+        elif parity == "双":
+            mask &= int("01" * (end // 2 + 1), 2)
+        return cls.from_mask(mask)
+
+    @classmethod
+    def odd(cls, start: int, end: int) -> "WeekSet":
+        return cls.range(start, end, "单")
+
+    @classmethod
+    def even(cls, start: int, end: int) -> "WeekSet":
+        return cls.range(start, end, "双")
+
+    @classmethod
+    def parse(cls, text: str) -> "WeekSet":
+        """
+        解析周次文本：
+        如 "1-16双"、"[1-16周]"、"1, 3, 5"、"1-8, 10-16单"
+        """
+        mask = 0
+        for token in cls._SEPARATORS.split(text):
+            token = token.strip("[]【】")
+            if not token:
+                continue
+            m = cls._TOKEN.fullmatch(token)
+            if not m:
+                raise ValueError(f"无法识别的周次：{token}")
+            start = int(m.group(1))
+            end = int(m.group(2)) if m.group(2) else start
+            mask |= cls.range(start, end, m.group(3)).mask
+        return cls.from_mask(mask)
+
+    def __contains__(self, week: int) -> bool:
+        return week >= 0 and bool(self.mask >> week & 1)
+
+    def __iter__(self) -> Iterator[int]:
+        mask, week = self.mask, 0
+        while mask:
+            low = mask & -mask
+            week = low.bit_length() - 1
+            yield week
+            mask ^= low
+
+    def __len__(self) -> int:
+        return bin(self.mask).count("1")
+
+    def __bool__(self) -> bool:
+        return bool(self.mask)
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, WeekSet):
+            return self.mask == other.mask
+        return NotImplemented
+
+    def __hash__(self) -> int:
+        return hash(self.mask)
+
+    def __or__(self, other: "WeekSet") -> "WeekSet":
+        return WeekSet.from_mask(self.mask | other.mask)
+
+    def __and__(self, other: "WeekSet") -> "WeekSet":
+        return WeekSet.from_mask(self.mask & other.mask)
+
+    def __sub__(self, other: "WeekSet") -> "WeekSet":
+        return WeekSet.from_mask(self.mask & ~other.mask)
+
+    def count(self, week: int) -> int:
+        """
+        与 list.count 兼容：集合中不存在重复周次，返回 0 或 1
+        """
+        return int(week in self)
+
+    def __repr__(self) -> str:
+        return f"WeekSet({str(self)!r})"
+
+    def __str__(self) -> str:
+        """
+        以范围记法输出：连续周次写作 "1-16"，隔周写作 "1-15单" / "2-16双"
+        """
+        weeks = list(self)
+        parts = []
+        i = 0
+        while i < len(weeks):
+            j = i
+            while j + 1 < len(weeks) and weeks[j + 1] == weeks[j] + 1:
+                j += 1
+            if j > i:
+                parts.append(f"{weeks[i]}-{weeks[j]}")
+                i = j + 1
+                continue
+            while j + 1 < len(weeks) and weeks[j + 1] == weeks[j] + 2:
+                j += 1
+            if j - i >= 2:
+                parts.append(f"{weeks[i]}-{weeks[j]}{'单' if weeks[i] % 2 else '双'}")
+                i = j + 1
+                continue
+            parts.append(str(weeks[i]))
+            i += 1
+        return ", ".join(parts)
 
 
 @dataclass
@@ -11,8 +153,9 @@ class Course:
     teacher: str
     classroom: str
     weekday: int
-    weeks: list[int]
+    weeks: Union[list[int], WeekSet]
     indexes: list[int]
+    group: str = ""
 
     def title(self) -> str:
         """
@@ -53,27 +196,247 @@ class Course:
         return [i for i in range(start, end + 1) if not i % 2]
 
 
+class Event:
+    """
+    单次上课事件（内部表示）：
+    使用 __slots__ 代替逐事件的 dict，星期、节次由所属课程提供，不再逐事件复制；
+    remapped_from 为调课来源日期（ISO 格式），原始事件为 None
+    """
+    __slots__ = ("course", "week", "start_dt", "end_dt", "remapped_from")
+
+    def __init__(self, course: Course, week: int, start_dt: datetime, end_dt: datetime,
+                 remapped_from: Optional[str] = None) -> None:
+        self.course = course
+        self.week = week
+        self.start_dt = start_dt
+        self.end_dt = end_dt
+        self.remapped_from = remapped_from
+
+    @property
+    def weekday(self) -> int:
+        return self.course.weekday
+
+    @property
+    def indexes(self) -> tuple[int, ...]:
+        return tuple(self.course.indexes)
+
+
+def escape(text: str) -> str:
+    """
+    按 RFC 5545 转义 TEXT 类型的属性值
+    """
+    return (text.replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,")
+            .replace("\r\n", "\\n").replace("\n", "\\n"))
+
+
+def _to_date(value: Any) -> date:
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return datetime.fromisoformat(value).date()
+
+
+@dataclass(frozen=True)
+class Adjustments:
+    """
+    编译后的调休规则：
+    off_dates 为放假日期，remap 为 (上课日期, 按哪一天的课表上课) 列表，errors 为逐条校验的错误信息。
+    编译一次即可在多个 School 间复用（如全国统一的节假日安排），也可用 merge() 与学校自己的安排合并
+    """
+    off_dates: frozenset = frozenset()
+    remap: tuple = ()
+    errors: tuple = ()
+
+    @classmethod
+    def compile(cls, data: Optional[dict]) -> "Adjustments":
+        """
+        由 {"off_dates": [...], "remap": [{"date": ..., "from": ...}]} 编译；
+        无效条目逐条记入 errors 并跳过，不影响其余条目
+        """
+        if not data:
+            return cls()
+        if not isinstance(data, dict):
+            return cls(errors=(f"调休数据应为 JSON 对象，实际为 {type(data).__name__}",))
+        off_dates, remap, errors = set(), [], []
+        with metrics.span("adjustments.compile"):
+            for i, d in enumerate(data.get("off_dates") or []):
+                try:
+                    off_dates.add(_to_date(d))
+                except (TypeError, ValueError):
+                    errors.append(f"off_dates 第 {i + 1} 项不是有效日期：{d!r}")
+            for i, m in enumerate(data.get("remap") or []):
+                try:
+                    remap.append((_to_date(m["date"]), _to_date(m["from"])))
+                except (KeyError, TypeError, ValueError):
+                    errors.append(f"remap 第 {i + 1} 项无效（需要 date 与 from 两个日期）：{m!r}")
+        return cls(frozenset(off_dates), tuple(remap), tuple(errors))
+
+    def merge(self, other: "Adjustments") -> "Adjustments":
+        return Adjustments(self.off_dates | other.off_dates, self.remap + other.remap, self.errors + other.errors)
+
+    def to_dict(self) -> dict[str, Any]:
+        return {
+            "off_dates": sorted(d.isoformat() for d in self.off_dates),
+            "remap": [{"date": to_d.isoformat(), "from": from_d.isoformat()} for to_d, from_d in self.remap],
+        }
+
+
+def _format_offset(offset: timedelta) -> str:
+    seconds = int(offset.total_seconds())
+    sign = "+" if seconds >= 0 else "-"
+    hours, rest = divmod(abs(seconds), 3600)
+    minutes, seconds = divmod(rest, 60)
+    return f"{sign}{hours:02d}{minutes:02d}" + (f"{seconds:02d}" if seconds else "")
+
+
+@lru_cache(maxsize=None)
+def vtimezone(tzid: str, first_year: int, last_year: int) -> tuple[str, ...]:
+    """
+    用 zoneinfo 生成 first_year 至 last_year 年间的完整 VTIMEZONE 定义：
+    每次 UTC 偏移变化（夏令时切换等）输出一个 STANDARD / DAYLIGHT 分量。
+    结果按参数缓存，批量生成时每个进程对同一时区只计算一次
+    """
+    from zoneinfo import ZoneInfo
+
+    zone = ZoneInfo(tzid)
+    begin = datetime(first_year, 1, 1, tzinfo=timezone.utc)
+    end = datetime(last_year + 1, 1, 1, tzinfo=timezone.utc)
+
+    def local(t: datetime) -> datetime:
+        return t.astimezone(zone)
+
+    def component(t: datetime, offset_from: timedelta, wall: Optional[datetime] = None) -> list[str]:
+        after = local(t)
+        kind = "DAYLIGHT" if after.dst() else "STANDARD"
+        wall = wall or (t + offset_from).replace(tzinfo=None)
+        return [
+            f"BEGIN:{kind}",
+            f"DTSTART:{wall:%Y%m%dT%H%M%S}",
+            f"TZOFFSETFROM:{_format_offset(offset_from)}",
+            f"TZOFFSETTO:{_format_offset(after.utcoffset())}",
+            f"TZNAME:{after.tzname()}",
+            f"END:{kind}",
+        ]
+
+    offset = local(begin).utcoffset()
+    lines = ["BEGIN:VTIMEZONE", f"TZID:{tzid}"] + component(begin, offset, datetime(first_year, 1, 1))
+    day = begin
+    while day < end:
+        following = day + timedelta(days=1)
+        if local(following).utcoffset() != offset:
+            # 二分查找到分钟：lo 仍为旧偏移，hi 为新偏移
+            lo, hi = 0, 24 * 60
+            while hi - lo > 1:
+                mid = (lo + hi) // 2
+                if local(day + timedelta(minutes=mid)).utcoffset() == offset:
+                    lo = mid
+                else:
+                    hi = mid
+            moment = day + timedelta(minutes=hi)
+            lines += component(moment, offset)
+            offset = local(moment).utcoffset()
+        day = following
+    lines.append("END:VTIMEZONE")
+    return tuple(lines)
+
+
+class EventIndex:
+    """
+    事件指纹索引，用于增量生成：
+    以 UID（由原有的 md5 uid_src 得到）记录每个事件的内容哈希、DTSTAMP 与 SEQUENCE，
+    内容不变的事件保持 DTSTAMP / SEQUENCE 不变，内容变化时 SEQUENCE 加一；
+    同时按课程缓存已渲染的事件，课程与相关调休未变化时不再重新展开。
+    events 可通过 to_dict() / from_dict() 持久化
+    """
+
+    def __init__(self) -> None:
+        self.events: dict[str, dict[str, Any]] = {}
+        self.cancelled: dict[str, dict[str, Any]] = {}
+        self.changes: dict[str, str] = {}
+        self._rendered: dict[tuple, list[list[str]]] = {}
+        self._next_rendered: dict[tuple, list[list[str]]] = {}
+        self._seen: set[str] = set()
+
+    def to_dict(self) -> dict[str, Any]:
+        return {"events": self.events}
+
+    @classmethod
+    def from_dict(cls, data: dict[str, Any]) -> "EventIndex":
+        index = cls()
+        index.events = dict(data.get("events", {}))
+        return index
+
+    def begin(self) -> None:
+        self.changes = {}
+        self._seen = set()
+        self._next_rendered = {}
+
+    def rendered(self, key: tuple) -> Optional[list[list[str]]]:
+        return self._rendered.get(key)
+
+    def keep(self, key: tuple, events: list[list[str]]) -> None:
+        self._next_rendered[key] = events
+
+    def stamp(self, lines: list[str], runtime: datetime) -> list[str]:
+        """
+        为单个事件填入稳定的 DTSTAMP 与 SEQUENCE，并记录其状态（added / changed / unchanged）
+        """
+        uid = lines[1][len("UID:"):]
+        digest = md5("\n".join(lines[3:]).encode()).hexdigest()
+        entry = self.events.get(uid)
+        if entry is None:
+            entry = {"hash": digest, "dtstamp": f"{runtime:%Y%m%dT%H%M%SZ}", "sequence": 0}
+            self.changes.setdefault(uid, "added")
+        elif entry["hash"] != digest and uid not in self._seen:
+            entry = {"hash": digest, "dtstamp": f"{runtime:%Y%m%dT%H%M%SZ}", "sequence": entry["sequence"] + 1}
+            self.changes[uid] = "changed"
+        else:
+            self.changes.setdefault(uid, "unchanged")
+        entry["dtstart"] = lines[3]
+        self.events[uid] = entry
+        self._seen.add(uid)
+        return [lines[0], lines[1], f"DTSTAMP:{entry['dtstamp']}", f"SEQUENCE:{entry['sequence']}"] + lines[3:]
+
+    def finish(self) -> None:
+        """
+        本次未出现的事件记为取消，并从索引中移除
+        """
+        self.cancelled = {uid: e for uid, e in self.events.items() if uid not in self._seen}
+        for uid in self.cancelled:
+            del self.events[uid]
+        self._rendered = self._next_rendered
+
+
 @dataclass
 class School:
     duration: int = 45
     timetable: list[tuple[int, int]] = field(default_factory=list)
     start: tuple[int, int, int] = (2023, 9, 1)
     courses: list[Course] = field(default_factory=list)
-    adjustments: dict = field(default_factory=dict)
+    adjustments: Union[dict, Adjustments] = field(default_factory=dict)
+    compact: bool = False
+    timezone: str = "Asia/Shanghai"
 
     HEADERS = [
         "BEGIN:VCALENDAR",
         "METHOD:PUBLISH",
         "VERSION:2.0",
         "X-WR-CALNAME:课表",
-        "X-WR-TIMEZONE:Asia/Shanghai",
-        "CALSCALE:GREGORIAN",
-        "BEGIN:VTIMEZONE",
-        "TZID:Asia/Shanghai",
-        "END:VTIMEZONE"]
+        "CALSCALE:GREGORIAN"]
     FOOTERS = ["END:VCALENDAR"]
+    # timezone 的两个特殊取值：UTC 时间（以 Z 结尾）与浮动时间（不带时区，按设备本地时间显示）
+    UTC = "UTC"
+    FLOATING = "floating"
 
     def __post_init__(self) -> None:
+        with metrics.span("school.build"):
+            self._setup()
+
+    def _setup(self) -> None:
+        """
+        校验课程与节次设置，预计算节次时间、周次日期表与调休规则
+        """
         assert self.timetable, "请设置每节课的上课时间，以 24 小时制两元素元组方式输入小时、分钟"
         assert len(self.start) >= 3, "请设置为开学第一周的日期，以元素元组方式输入年、月、日"
         assert self.courses, "请设置你的课表数组，每节课是一个 Course 实例"
@@ -81,6 +444,8 @@ class School:
         for c in self.courses:
             if not c.indexes:
                 raise ValueError(f"{c.name} 未设置节次")
+            if not 1 <= c.weekday <= 7:
+                raise ValueError(f"{c.name} 的星期 {c.weekday} 不在 1-7 之间")
             c.indexes.sort()
         # Ensure timetable covers all course indexes to avoid IndexError in time()
         max_index = max(i for c in self.courses for i in c.indexes)
@@ -88,116 +453,535 @@ class School:
             raise ValueError(
                 f"课程节次 {max_index} 超过设定的总节数 {len(self.timetable) - 1}, 请检查课表设置"
             )
+        if self.timezone not in (self.UTC, self.FLOATING):
+            # zoneinfo 只在使用具名时区时导入
+            from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+            try:
+                ZoneInfo(self.timezone)
+            except (ZoneInfoNotFoundError, ValueError):
+                raise ValueError(f"未知时区：{self.timezone}") from None
+        # DTSTART / DTEND 等属性的时区参数与时间后缀
+        self._tz_param = "" if self.timezone in (self.UTC, self.FLOATING) else f";TZID={self.timezone}"
+        self._tz_suffix = "Z" if self.timezone == self.UTC else ""
         self.start_dt = datetime(*self.start[:3])
         self.start_dt -= timedelta(days=self.start_dt.weekday())
+        # 预计算每节课相对当天零点的 (开始, 结束) 偏移，以及 周次 × 星期 的日期表
+        duration = timedelta(minutes=self.duration)
+        self._starts = [timedelta(hours=h, minutes=m) for h, m in self.timetable]
+        self._ends = [t + duration for t in self._starts]
+        self._dates: dict[int, list[datetime]] = {}
+        for week in {w for c in self.courses for w in c.weeks}:
+            self._week_dates(week)
+        # 按星期索引课程，调课时只需查找来源日期当天的课程
+        self._by_weekday: dict[int, list[Course]] = {}
+        for c in self.courses:
+            self._by_weekday.setdefault(c.weekday, []).append(c)
+        self._template_cache: tuple[Optional[Course], tuple[str, list[str]]] = (None, ("", []))
+        self._time_strings: dict[datetime, tuple[str, str]] = {}
+        self._stamp_cache: tuple[Optional[datetime], str] = (None, "")
+        if isinstance(self.adjustments, Adjustments):
+            self._adjustments = self.adjustments
+        else:
+            self._adjustments = Adjustments.compile(self.adjustments)
+
+    @property
+    def adjustment_errors(self) -> tuple:
+        """
+        调休数据中被跳过的无效条目说明
+        """
+        return self._adjustments.errors
+
+    def _week_dates(self, week: int) -> list[datetime]:
+        """
+        返回第 week 周周一至周日零点的日期列表（下标 1-7），未预计算的周次按需补充
+        """
+        dates = self._dates.get(week)
+        if dates is None:
+            monday = self.start_dt + timedelta(weeks=week - 1)
+            dates = [monday + timedelta(days=d - 1) for d in range(8)]
+            self._dates[week] = dates
+        return dates
 
     def time(self, week: int, weekday: int, index: int, plus: bool = False) -> datetime:
         """
         生成详细的日期和时间：
         week: 第几周，weekday: 周几，index: 第几节课，plus: 是否增加课程时间
         """
-        date = self.start_dt + timedelta(weeks=week - 1, days=weekday - 1)
-        return date.replace(
-            hour=self.timetable[index][0], minute=self.timetable[index][1]
-        ) + timedelta(minutes=self.duration if plus else 0)
+        return self._week_dates(week)[weekday] + (self._ends[index] if plus else self._starts[index])
 
-    def generate(self) -> str:
-        runtime = datetime.now()
-        texts = []
-        
-        # 1) 生成全部原始事件（不考虑调休）
-        all_events = []  # list of dict for easier post-process
+    def expand(self, course: Course, weeks: Optional[Iterable[int]] = None) -> list[tuple[datetime, datetime]]:
+        """
+        一次展开课程在各周的 (开始, 结束) 时间：
+        weeks 默认为 course.weeks
+        """
+        start = self._starts[course.indexes[0]]
+        end = self._ends[course.indexes[-1]]
+        weekday = course.weekday
+        dates = self._dates
+        result = []
+        for week in course.weeks if weeks is None else weeks:
+            day = (dates.get(week) or self._week_dates(week))[weekday]
+            result.append((day + start, day + end))
+        return result
+
+    def _off_weeks(self) -> dict[int, set[int]]:
+        """
+        将放假日期换算为 星期 -> 放假周次集合，过滤事件时按 (周次, 星期) 查表
+        """
+        with metrics.span("adjust.off_weeks"):
+            return self._compute_off_weeks()
+
+    def _compute_off_weeks(self) -> dict[int, set[int]]:
+        start_date = self.start_dt.date()
+        off_weeks: dict[int, set[int]] = {}
+        for d in self._adjustments.off_dates:
+            off_weeks.setdefault(d.isoweekday(), set()).add((d - start_date).days // 7 + 1)
+        return off_weeks
+
+    def _check_courses(self) -> None:
         for course in self.courses:
-            for week in course.weeks:
-                start_dt = self.time(week, course.weekday, course.indexes[0])
-                end_dt = self.time(week, course.weekday, course.indexes[-1], True)
-                if end_dt <= start_dt:
-                    raise ValueError(f"{course.name} 的结束时间不晚于开始时间，请检查节次设置")
-                all_events.append({
-                    "course": course,
-                    "week": week,
-                    "weekday": course.weekday,
-                    "indexes": tuple(course.indexes),
-                    "start_dt": start_dt,
-                    "end_dt": end_dt,
-                })
-
-        # 2) 解析调休数据
-        off_dates = set()
-        remap_pairs = []  # list of (to_date, from_date)
-        if self.adjustments:
-            try:
-                for d in self.adjustments.get("off_dates", []) or []:
-                    off_dates.add(datetime.fromisoformat(d).date())
-                for m in self.adjustments.get("remap", []) or []:
-                    to_d = datetime.fromisoformat(m.get("date")).date()
-                    from_d = datetime.fromisoformat(m.get("from")).date()
-                    remap_pairs.append((to_d, from_d))
-            except Exception:
-                # 忽略无效的调休输入，按无调休处理
-                off_dates = set()
-                remap_pairs = []
-
-        # 3) 先基于 off_dates 过滤原始事件
-        filtered_events = [e for e in all_events if e["start_dt"].date() not in off_dates]
-
-        # 4) 基于 remap 复制事件：将 from_date 的事件复制到 to_date（时间点不变，仅日期替换）
-        remapped_events = []
-        if remap_pairs:
-            # 建立 from_date -> 事件列表 的索引（从全部事件中取，确保假期被移除但仍可作为来源）
-            from_index = {}
-            for e in all_events:
-                d = e["start_dt"].date()
-                from_index.setdefault(d, []).append(e)
-            for to_date, from_date in remap_pairs:
-                for src in from_index.get(from_date, []):
-                    # 复制并替换日期
-                    start_dt = src["start_dt"].replace(year=to_date.year, month=to_date.month, day=to_date.day)
-                    end_dt = src["end_dt"].replace(year=to_date.year, month=to_date.month, day=to_date.day)
-                    remapped_events.append({
-                        "course": src["course"],
-                        "week": src["week"],
-                        "weekday": src["weekday"],
-                        "indexes": src["indexes"],
-                        "start_dt": start_dt,
-                        "end_dt": end_dt,
-                        "remapped_from": from_date.isoformat(),
-                        "remapped_to": to_date.isoformat(),
-                    })
-
-        final_events = filtered_events + remapped_events
-
-        # 5) 渲染到 ICS 文本
-        events = []
-        for e in final_events:
-            course = e["course"]
-            start_dt = e["start_dt"]
-            end_dt = e["end_dt"]
-            uid_src = (
-                course.title(),
-                start_dt.date().isoformat(),
-                tuple(e["indexes"]),
-                e.get("remapped_from", "orig"),
+            if course.weeks and self._ends[course.indexes[-1]] <= self._starts[course.indexes[0]]:
+                raise ValueError(f"{course.name} 的结束时间不晚于开始时间，请检查节次设置")
+
+    def _iter_original(self, course: Course, off_weeks: set[int]) -> Iterator[Event]:
+        """
+        产出单门课程的原始事件，跳过 off_weeks 中的放假周次；开启埋点时计入 expand
+        """
+        events = self._original(course, off_weeks)
+        return metrics.timed("expand", events) if metrics.enabled() else events
+
+    def _original(self, course: Course, off_weeks: set[int]) -> Iterator[Event]:
+        for week, (start_dt, end_dt) in zip(course.weeks, self.expand(course)):
+            if week not in off_weeks:
+                yield Event(course, week, start_dt, end_dt)
+
+    def _iter_remapped(self, remap_pairs: list) -> Iterator[Event]:
+        """
+        产出调课事件：将 from_date 的事件复制到 to_date（时间点不变，仅日期替换）；
+        来源事件直接由 from_date 反推周次与星期，不需要建立全量事件索引（放假日期仍可作为来源）；
+        开启埋点时计入 adjust.remap
+        """
+        events = self._remapped(remap_pairs)
+        return metrics.timed("adjust.remap", events) if metrics.enabled() else events
+
+    def _remapped(self, remap_pairs: list) -> Iterator[Event]:
+        start_date = self.start_dt.date()
+        for to_date, from_date in remap_pairs:
+            week = (from_date - start_date).days // 7 + 1
+            weekday = from_date.isoweekday()
+            to_day = datetime(to_date.year, to_date.month, to_date.day)
+            for course in self._by_weekday.get(weekday, ()):
+                for _ in range(course.weeks.count(week)):
+                    yield Event(
+                        course, week,
+                        to_day + self._starts[course.indexes[0]],
+                        to_day + self._ends[course.indexes[-1]],
+                        from_date.isoformat(),
+                    )
+
+    def _iter_events(self) -> Iterator[Event]:
+        """
+        逐个产出日历事件，不在内存中保存整张日历：
+        先按课程顺序产出未被 off_dates 过滤的原始事件，再按 remap 顺序产出调课复制的事件
+        """
+        self._check_courses()
+        off_weeks = self._off_weeks()
+        for course in self.courses:
+            yield from self._iter_original(course, off_weeks.get(course.weekday, set()))
+        yield from self._iter_remapped(self._adjustments.remap)
+
+    def _iter_series(self, runtime: datetime) -> Iterator[list[str]]:
+        """
+        紧凑模式：每门课程渲染为一个 RRULE:FREQ=WEEKLY 循环事件，
+        周次空缺与放假日期写入 EXDATE，调课日期写入 RDATE；
+        无法用循环规则表达的实例（重复周次、与已有实例冲突的调课）仍作为单独事件输出，
+        展开后的实例集合与逐周输出完全一致
+        """
+        self._check_courses()
+        off_weeks = self._off_weeks()
+        remapped = self._group_remapped(self._adjustments.remap)
+        for course in self.courses:
+            yield from self._render_series(
+                course, off_weeks.get(course.weekday, set()), remapped.get(id(course), []), runtime
             )
-            events.append([
+
+    def _group_remapped(self, remap_pairs: list) -> dict[int, list[Event]]:
+        """
+        按来源课程分组调课事件
+        """
+        remapped: dict[int, list[Event]] = {}
+        for e in self._iter_remapped(remap_pairs):
+            remapped.setdefault(id(e.course), []).append(e)
+        return remapped
+
+    def _render_series(self, course: Course, off_weeks: set[int], extras: list[Event],
+                       runtime: datetime) -> Iterator[list[str]]:
+        """
+        渲染单门课程的循环事件，extras 为该课程的调课事件
+        """
+        weeks = sorted(set(course.weeks))
+        if not weeks:
+            return
+        if len(weeks) < len(course.weeks):
+            # 重复的周次无法用循环规则表达，按逐周方式输出多余的实例
+            seen = set()
+            for e in self._iter_original(course, off_weeks):
+                if e.week in seen:
+                    yield self._render_event(e, runtime)
+                seen.add(e.week)
+
+        interval = 2 if all((w - weeks[0]) % 2 == 0 for w in weeks) and len(weeks) > 1 else 1
+        slots = list(range(weeks[0], weeks[-1] + 1, interval))
+        week_set = set(weeks)
+        instances, exdates = set(), []
+        for week, (start_dt, _) in zip(slots, self.expand(course, slots)):
+            if week in week_set and week not in off_weeks:
+                instances.add(start_dt)
+            else:
+                exdates.append(start_dt)
+        excluded = set(exdates)
+        rdates = []
+        for e in extras:
+            start_dt = e.start_dt
+            if instances and start_dt not in instances and start_dt not in excluded:
+                instances.add(start_dt)
+                rdates.append(start_dt)
+            else:
+                yield self._render_event(e, runtime)
+        if not instances:
+            return
+
+        first_start, first_end = self.expand(course, slots[:1])[0]
+        rule = f"RRULE:FREQ=WEEKLY;COUNT={len(slots)}"
+        if interval > 1:
+            rule = f"RRULE:FREQ=WEEKLY;INTERVAL={interval};COUNT={len(slots)}"
+        title, static = self._template(course)
+        uid_src = (title, first_start.date().isoformat(), tuple(course.indexes), "rrule")
+        lines = [
+            "BEGIN:VEVENT",
+            f"UID:{md5(str(uid_src).encode()).hexdigest()}",
+            self._dtstamp(runtime),
+            f"DTSTART{self._tz_param}:{self._format_time(first_start)[0]}",
+            f"DTEND{self._tz_param}:{self._format_time(first_end)[0]}",
+            rule,
+        ]
+        if exdates:
+            lines.extend(self._fold(
+                f"EXDATE{self._tz_param}:" + ",".join(self._format_time(d)[0] for d in exdates)
+            ))
+        if rdates:
+            lines.extend(self._fold(
+                f"RDATE{self._tz_param}:" + ",".join(self._format_time(d)[0] for d in rdates)
+            ))
+        lines += static
+        lines.append("END:VEVENT")
+        yield lines
+
+    def _course_key(self, course: Course, off_weeks: set[int], extras: list[Event]) -> tuple:
+        """
+        单门课程渲染结果依赖的全部输入，用作增量生成的缓存键
+        """
+        return (
+            self.compact, self.timezone, course.name, course.teacher, course.classroom, course.weekday,
+            tuple(course.weeks), tuple(course.indexes), course.title(), course.description(),
+            self.start_dt, self._starts[course.indexes[0]], self._ends[course.indexes[-1]],
+            tuple(sorted(off_weeks)),
+            tuple((e.start_dt, e.remapped_from) for e in extras),
+        )
+
+    def _iter_indexed(self, index: EventIndex, runtime: datetime) -> Iterator[list[str]]:
+        """
+        增量模式：按课程复用索引中缓存的渲染结果，只重新展开输入发生变化的课程，
+        并为每个事件填入稳定的 DTSTAMP / SEQUENCE
+        """
+        self._check_courses()
+        off_weeks = self._off_weeks()
+        remapped = self._group_remapped(self._adjustments.remap)
+        index.begin()
+        for course in self.courses:
+            extras = remapped.get(id(course), [])
+            weeks_off = off_weeks.get(course.weekday, set())
+            key = self._course_key(course, weeks_off, extras)
+            events = index.rendered(key)
+            if events is None:
+                if self.compact:
+                    events = list(self._render_series(course, weeks_off, extras, runtime))
+                else:
+                    events = [self._render_event(e, runtime)
+                              for e in chain(self._iter_original(course, weeks_off), extras)]
+            index.keep(key, events)
+            for lines in events:
+                yield index.stamp(lines, runtime)
+        index.finish()
+
+    def _headers(self) -> list[str]:
+        """
+        日历头部：固定部分加上时区声明与覆盖整个学期的 VTIMEZONE
+        """
+        if self.timezone == self.FLOATING:
+            return list(self.HEADERS)
+        headers = self.HEADERS + [f"X-WR-TIMEZONE:{self.timezone}"]
+        if self.timezone == self.UTC:
+            return headers
+        last = max((w for c in self.courses for w in c.weeks), default=1)
+        last_year = max([self.time(last, 7, 0).year] + [to_d.year for to_d, _ in self._adjustments.remap])
+        return headers + list(vtimezone(self.timezone, self.start_dt.year, last_year))
+
+    def _dtstamp(self, runtime: datetime) -> str:
+        if self._stamp_cache[0] is not runtime:
+            self._stamp_cache = (runtime, f"DTSTAMP:{runtime:%Y%m%dT%H%M%SZ}")
+        return self._stamp_cache[1]
+
+    def _template(self, course: Course) -> tuple[str, list[str]]:
+        """
+        每门课程的静态部分（SUMMARY / DESCRIPTION / URL）只转义、折行一次，
+        返回 (标题, 已折行的静态行)；逐事件渲染时只需拼接 UID / DTSTART / DTEND。
+        同一课程的事件是连续渲染的，只缓存最近一门课程，内存占用与课程数无关
+        """
+        if self._template_cache[0] is not course:
+            title = course.title()
+            lines = []
+            for line in (f"SUMMARY:{escape(title)}", f"DESCRIPTION:{escape(course.description())}", "URL;VALUE=URI:"):
+                lines.extend(self._fold(line))
+            self._template_cache = (course, (title, lines))
+        return self._template_cache[1]
+
+    def _format_time(self, dt: datetime) -> tuple[str, str]:
+        """
+        返回 (ICS 时间字符串, ISO 日期)；同一学期内不同的上课时刻有限，结果按时刻缓存
+        """
+        cached = self._time_strings.get(dt)
+        if cached is None:
+            cached = self._time_strings[dt] = (f"{dt:%Y%m%dT%H%M%S}{self._tz_suffix}", dt.date().isoformat())
+        return cached
+
+    def _render_event(self, e: Event, runtime: datetime) -> list[str]:
+        course = e.course
+        title, static = self._template(course)
+        start, day = self._format_time(e.start_dt)
+        uid_src = (
+            title,
+            day,
+            tuple(course.indexes),
+            e.remapped_from or "orig",
+        )
+        return [
+            "BEGIN:VEVENT",
+            f"UID:{md5(str(uid_src).encode()).hexdigest()}",
+            self._dtstamp(runtime),
+            f"DTSTART{self._tz_param}:{start}",
+            f"DTEND{self._tz_param}:{self._format_time(e.end_dt)[0]}",
+            *static,
+            "END:VEVENT",
+        ]
+
+    @staticmethod
+    def _fold(line: str) -> Iterator[str]:
+        """
+        按 RFC 5545 折行：每行不超过 75 个字节（UTF-8），续行以一个空格开头，
+        不会从多字节字符中间断开
+        """
+        if len(line) <= 75 and line.isascii():
+            yield line
+            return
+        data = line.encode()
+        if len(data) <= 75:
+            yield line
+            return
+        start, limit, prefix = 0, 75, ""
+        while start < len(data):
+            end = min(start + limit, len(data))
+            while end < len(data) and data[end] & 0xC0 == 0x80:
+                end -= 1
+            yield prefix + data[start:end].decode()
+            start, limit, prefix = end, 74, " "
+
+    def iter_lines(self, index: Optional[EventIndex] = None) -> Iterator[str]:
+        """
+        逐行产出折行后的 ICS 文本（不含换行符）：
+        每次只渲染一个事件，内存占用与课程数、周数无关；
+        compact 为 True 时每门课程输出为一个循环事件；
+        传入 index 时按增量模式生成，未变化的事件保持 DTSTAMP / SEQUENCE 不变
+        """
+        lines = self._iter_lines(index)
+        return metrics.trace_lines("render", lines) if metrics.enabled() else lines
+
+    def _iter_lines(self, index: Optional[EventIndex]) -> Iterator[str]:
+        runtime = datetime.now()
+        self._template_cache = (None, ("", []))
+        if index is not None:
+            events = self._iter_indexed(index, runtime)
+        elif self.compact:
+            events = self._iter_series(runtime)
+        else:
+            events = (self._render_event(e, runtime) for e in self._iter_events())
+        # 先取第一个事件，使节次设置错误在输出任何内容之前抛出
+        first = next(events, None)
+        for line in self._headers():
+            yield from self._fold(line)
+        if first is not None:
+            # 事件各行在渲染时已折行（静态行随课程模板折行一次），这里直接输出
+            for event in chain((first,), events):
+                yield from event
+        for line in self.FOOTERS:
+            yield from self._fold(line)
+
+    def delta(self, index: EventIndex) -> str:
+        """
+        增量生成并只输出相对上次生成发生变化的事件：
+        新增与修改的事件，以及已被删除的事件（STATUS:CANCELLED）；index 会同步更新
+        """
+        runtime = datetime.now()
+        self._template_cache = (None, ("", []))
+        changed = []
+        for lines in self._iter_indexed(index, runtime):
+            uid = lines[1][len("UID:"):]
+            if index.changes.get(uid) in ("added", "changed"):
+                changed.append(lines)
+        for uid, e in index.cancelled.items():
+            changed.append([
                 "BEGIN:VEVENT",
-                f"UID:{md5(str(uid_src).encode()).hexdigest()}",
+                f"UID:{uid}",
                 f"DTSTAMP:{runtime:%Y%m%dT%H%M%SZ}",
-                f"DTSTART;TZID=Asia/Shanghai:{start_dt:%Y%m%dT%H%M%S}",
-                f"DTEND;TZID=Asia/Shanghai:{end_dt:%Y%m%dT%H%M%S}",
-                f"SUMMARY:{course.title()}",
-                f"DESCRIPTION:{course.description()}",
-                "URL;VALUE=URI:",
+                f"SEQUENCE:{e['sequence'] + 1}",
+                e["dtstart"],
+                "STATUS:CANCELLED",
                 "END:VEVENT",
             ])
-        items = [line for event in events for line in event]
-        for line in self.HEADERS + items + self.FOOTERS:
-            first = True
-            while line:
-                texts.append((" " if not first else "") + line[:72])
-                line = line[72:]
-                first = False
+        texts = []
+        for line in self._headers():
+            texts.extend(self._fold(line))
+        for lines in changed:
+            texts.extend(lines)
+        for line in self.FOOTERS:
+            texts.extend(self._fold(line))
         return "\n".join(texts)
 
+    def write(self, fp: TextIO, index: Optional[EventIndex] = None) -> None:
+        """
+        将 ICS 直接流式写入文件对象（或任意带 write 方法的对象，如 HTTP 响应）
+        """
+        sep = ""
+        for line in self.iter_lines(index):
+            fp.write(sep + line)
+            sep = "\n"
+
+    def generate(self, index: Optional[EventIndex] = None) -> str:
+        return "\n".join(self.iter_lines(index))
+
+
+@dataclass
+class Conflict:
+    """
+    同一教师 / 教室在同一天同一节次有多门不同的课程；
+    同名、同教师、同教室的合班课程不算冲突
+    """
+    key: str
+    value: str
+    day: date
+    indexes: list[int]
+    events: list[Event]
 
 
+class Institution:
+    """
+    全校课表：所有课程只展开一次，按教师、教室、课程名、班级（Course.group）建立事件索引，
+    各视图（某教室的全部课程、某教师的全部授课、多个班级合并的课表）直接由同一份事件派生，
+    不再逐视图重新展开；冲突检测也基于同一索引，按 (值, 日期, 节次) 分桶，耗时与事件数成线性
+    """
+    KEYS = ("teacher", "classroom", "name", "group")
+
+    def __init__(self, school: School) -> None:
+        self.school = school
+        self.events: list[Event] = list(school._iter_events())
+        self._indexes: dict[str, dict[str, list[Event]]] = {key: {} for key in self.KEYS}
+        for e in self.events:
+            for key, index in self._indexes.items():
+                value = getattr(e.course, key)
+                if value:
+                    index.setdefault(value, []).append(e)
+
+    def values(self, key: str) -> list[str]:
+        """
+        某一维度的全部取值，如 values("classroom") 返回所有教室
+        """
+        return sorted(self._index(key))
+
+    def _index(self, key: str) -> dict[str, list[Event]]:
+        if key not in self._indexes:
+            raise ValueError(f"未知的索引：{key}，可选 {', '.join(self.KEYS)}")
+        return self._indexes[key]
+
+    def select(self, **criteria: Union[str, Iterable[str]]) -> list[Event]:
+        """
+        按条件筛选事件，如 select(classroom="北205")、select(teacher="王", group=["1班", "2班"])；
+        同一条件给出多个值时取并集，不同条件之间取交集
+        """
+        selected: Optional[dict[int, Event]] = None
+        for key, values in criteria.items():
+            index = self._index(key)
+            if isinstance(values, str):
+                values = [values]
+            matched = {id(e): e for value in values for e in index.get(value, ())}
+            if selected is not None:
+                matched = {k: e for k, e in selected.items() if k in matched}
+            selected = matched
+        return list(self.events) if selected is None else list(selected.values())
+
+    def iter_lines(self, events: Iterable[Event], name: str = "课表") -> Iterator[str]:
+        """
+        将选出的事件渲染为一份日历；合班课程在合并视图中只输出一次
+        """
+        school = self.school
+        runtime = datetime.now()
+        school._template_cache = (None, ("", []))
+        for line in school._headers():
+            yield from school._fold(f"X-WR-CALNAME:{escape(name)}" if line.startswith("X-WR-CALNAME:") else line)
+        seen = set()
+        for e in events:
+            key = (e.course.title(), e.start_dt, tuple(e.course.indexes), e.remapped_from)
+            if key in seen:
+                continue
+            seen.add(key)
+            yield from school._render_event(e, runtime)
+        for line in school.FOOTERS:
+            yield from school._fold(line)
+
+    def view(self, name: Optional[str] = None, **criteria: Union[str, Iterable[str]]) -> str:
+        """
+        生成派生日历，如 view(classroom="北205")；name 为日历名称，默认取条件的值
+        """
+        if name is None:
+            name = " ".join(v if isinstance(v, str) else "、".join(v) for v in criteria.values()) or "课表"
+        return "\n".join(self.iter_lines(self.select(**criteria), name))
+
+    def conflicts(self, key: str = "classroom") -> list[Conflict]:
+        """
+        检测教室（key="classroom"）或教师（key="teacher"）冲突：
+        将每个事件的每个节次放入 (值, 日期, 节次) 桶中，桶内出现多门不同课程即为冲突；
+        同一组课程在同一天的连续冲突节次合并为一条结果
+        """
+        slots: dict[tuple[str, date, int], list[Event]] = {}
+        for value, events in self._index(key).items():
+            for e in events:
+                day = e.start_dt.date()
+                for i in e.course.indexes:
+                    slots.setdefault((value, day, i), []).append(e)
+        merged: dict[tuple, Conflict] = {}
+        for (value, day, i), events in slots.items():
+            courses = {}
+            for e in events:
+                courses.setdefault((e.course.name, e.course.teacher, e.course.classroom), e)
+            if len(courses) < 2:
+                continue
+            conflict_key = (value, day, frozenset(courses))
+            conflict = merged.get(conflict_key)
+            if conflict is None:
+                merged[conflict_key] = Conflict(key, value, day, [i], list(courses.values()))
+            else:
+                conflict.indexes.append(i)
+        result = sorted(merged.values(), key=lambda c: (c.value, c.day, c.indexes[0]))
+        for conflict in result:
+            conflict.indexes.sort()
+        return result
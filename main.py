@@ -1,33 +1,56 @@
-from data import Course, School
-
-school = School(
-    duration=45,   # 每节课时间为 45 分钟
-    timetable=[
-        (8, 00),   # 上午第一节课时间为 8:30 至 9:15
-        (8, 50),
-        (10, 00),
-        (10, 50),
-        (13, 30),  # 下午第一节课时间为下午 2:30 至 3:15
-        (14, 20),
-        (15, 30),
-        (16, 20),
-        (17, 50),
-        (19, 00),
-        (19, 50),
-        (20, 40),
-    ],
-    start=(2025, 2, 24),  # 开学第一周当周周一至周日以内的任意日期
-    courses = [
-		Course(
-			name="工程管理",
-			teacher="王",
-			            classroom="北205",
-            weekday=4,
-			weeks=Course.week(1, 17),
-			indexes=[10, 11],
-		),
-	],
-)
-
-with open("课表.ics", "w") as w:
-    w.write(school.generate())
+"""
+命令行生成日历：只用到本仓库的纯 Python 模块（data.py、batch.py 中的 build_school 及其依赖）与标准库，
+不需要 openai / streamlit，适合在短时任务中快速启动。
+配置文件为 JSON 或 TOML（TOML 需要 Python 3.11+），格式同 batch.py 的单份课表定义，学校设置直接内联，见 example.toml。
+
+用法：
+python main.py example.toml                 # 输出到配置中的 output，默认为 课表.ics
+python main.py config.json -o -             # 输出到标准输出
+"""
+import argparse
+import json
+import sys
+from pathlib import Path
+
+from batch import build_school
+
+
+def load_config(path: str) -> dict:
+    file = Path(path)
+    if file.suffix == ".toml":
+        try:
+            import tomllib
+        except ModuleNotFoundError:
+            raise ValueError("读取 TOML 配置需要 Python 3.11+，请改用 JSON 配置") from None
+
+        with open(file, "rb") as f:
+            config = tomllib.load(f)
+    else:
+        config = json.loads(file.read_text(encoding="utf-8"))
+    if not isinstance(config, dict):
+        raise ValueError(f"配置文件顶层应为对象，实际为 {type(config).__name__}")
+    return config
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="由课表配置文件（JSON / TOML）生成 .ics 日历")
+    parser.add_argument("config", help="配置文件")
+    parser.add_argument("-o", "--output", help="输出文件，- 表示标准输出；默认取配置中的 output 或 课表.ics")
+    args = parser.parse_args()
+    try:
+        config = load_config(args.config)
+        school = build_school(config, {})
+    except (OSError, KeyError, TypeError, ValueError, AssertionError) as e:
+        # School 对缺少课程 / 节次时间等设置使用 assert 检查
+        raise SystemExit(f"配置有误：{type(e).__name__}: {e}")
+    output = args.output or config.get("output", "课表.ics")
+    if output == "-":
+        school.write(sys.stdout)
+        sys.stdout.write("\n")
+        return
+    with open(output, "w", encoding="utf-8") as w:
+        school.write(w)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+"""
+可选的性能埋点：
+解析 → 构建 → 渲染各阶段的计时 span 与计数器（生成事件数、折行数、输出字节数、LLM token 数、缓存命中等），
+可导出为指标字典（snapshot()），也可逐条输出为结构化日志（logging，logger 名为 "metrics"）；
+profile() 为单次请求采集 cProfile / tracemalloc 快照。
+
+默认关闭；设置环境变量 TIMETABLE_METRICS=1 或调用 enable() 开启。
+关闭时 span() 返回共享的空上下文管理器、count() 只做一次布尔判断，热路径中不逐行调用埋点函数。
+data.py 会导入本模块，logging / cProfile / tracemalloc 等只在用到时才导入，不拖慢启动。
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Iterable, Iterator, Optional, TypeVar
+
+T = TypeVar("T")
+
+_enabled = os.getenv("TIMETABLE_METRICS") == "1"
+_log = False
+_lock = threading.Lock()
+_spans: dict[str, list[float]] = {}
+_counters: dict[str, int] = {}
+_profiles: list[dict] = []
+_NULL = nullcontext()
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def enable(log: bool = False) -> None:
+    """
+    开启埋点；log 为 True 时每个 span 结束都输出一条 JSON 日志
+    """
+    global _enabled, _log
+    _enabled, _log = True, log
+
+
+def disable() -> None:
+    global _enabled, _log
+    _enabled, _log = False, False
+
+
+def reset() -> None:
+    with _lock:
+        _spans.clear()
+        _counters.clear()
+        _profiles.clear()
+
+
+def count(name: str, n: int = 1) -> None:
+    if _enabled:
+        with _lock:
+            _counters[name] = _counters.get(name, 0) + n
+
+
+def span(name: str):
+    """
+    计时上下文管理器：with span("school.build"): ...；关闭时没有额外开销
+    """
+    if not _enabled:
+        return _NULL
+    return _span(name)
+
+
+@contextmanager
+def _span(name: str) -> Iterator[None]:
+    begin = time.perf_counter()
+    try:
+        yield
+    finally:
+        _record(name, time.perf_counter() - begin)
+
+
+def _record(name: str, seconds: float) -> None:
+    with _lock:
+        # [次数, 总耗时, 最大耗时]
+        entry = _spans.setdefault(name, [0, 0.0, 0.0])
+        entry[0] += 1
+        entry[1] += seconds
+        entry[2] = max(entry[2], seconds)
+    if _log:
+        import json
+        import logging
+        logging.getLogger("metrics").info(json.dumps({"span": name, "seconds": round(seconds, 6)}))
+
+
+def timed(name: str, items: Iterable[T]) -> Iterator[T]:
+    """
+    包装生成器：只累计在生成器内部（next() 调用中）花费的时间，不含调用方处理每一项的时间
+    （如写文件、HTTP 发送），迭代结束时计为一个 span；仅在开启埋点时由调用方使用
+    """
+    it = iter(items)
+    clock = time.perf_counter
+    elapsed = 0.0
+    try:
+        while True:
+            begin = clock()
+            try:
+                item = next(it)
+            except StopIteration:
+                return
+            finally:
+                elapsed += clock() - begin
+            yield item
+    finally:
+        _record(name, elapsed)
+
+
+def trace_lines(name: str, lines: Iterator[str]) -> Iterator[str]:
+    """
+    包装逐行输出的 ICS：统计事件数、行数、折行产生的续行数与输出字节数。
+    name 的 span 只计生成 ICS 本身的耗时（不含调用方写出的时间），其中包含 expand（展开原始事件）
+    与 adjust.*（放假过滤、调课）子 span，渲染本身的耗时为 name 减去这些子 span 之和
+    """
+    events = total = folded = size = 0
+    try:
+        for line in timed(name, lines):
+            total += 1
+            size += len(line.encode()) + 1
+            if line.startswith(" "):
+                folded += 1
+            elif line == "BEGIN:VEVENT":
+                events += 1
+            yield line
+    finally:
+        count(f"{name}.events", events)
+        count(f"{name}.lines", total)
+        count(f"{name}.lines_folded", folded)
+        count(f"{name}.bytes", size)
+
+
+def snapshot() -> dict:
+    """
+    返回当前指标：{"spans": {名称: {"count", "total", "max"}}, "counters": {...}, "profiles": [...]}
+    """
+    with _lock:
+        return {
+            "spans": {name: {"count": c, "total": total, "max": longest}
+                      for name, (c, total, longest) in _spans.items()},
+            "counters": dict(_counters),
+            "profiles": list(_profiles),
+        }
+
+
+@contextmanager
+def profile(kind: str = "cprofile", limit: int = 30) -> Iterator[dict]:
+    """
+    为单次请求采集快照：kind 为 "cprofile"（按累计耗时排序的函数统计）或 "tracemalloc"（按行统计的内存分配）；
+    产出的字典在退出时填入 "report"，同时记入 snapshot()["profiles"]
+    """
+    result = {"kind": kind, "report": ""}
+    if kind == "cprofile":
+        import cProfile
+        import io
+        import pstats
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            yield result
+        finally:
+            profiler.disable()
+            out = io.StringIO()
+            pstats.Stats(profiler, stream=out).sort_stats("cumulative").print_stats(limit)
+            result["report"] = out.getvalue()
+    elif kind == "tracemalloc":
+        import tracemalloc
+
+        started = not tracemalloc.is_tracing()
+        if started:
+            tracemalloc.start()
+        try:
+            yield result
+        finally:
+            snap = tracemalloc.take_snapshot()
+            _, peak = tracemalloc.get_traced_memory()
+            if started:
+                tracemalloc.stop()
+            stats = snap.statistics("lineno")[:limit]
+            result["report"] = f"peak: {peak / 1024:.0f} KiB\n" + "\n".join(str(s) for s in stats)
+    else:
+        raise ValueError(f"未知的 profile 类型：{kind}，可选 cprofile、tracemalloc")
+    with _lock:
+        _profiles.append(result)
+
+
+def record_usage(usage: Optional[object]) -> None:
+    """
+    记录 OpenAI 兼容接口返回的 token 用量
+    """
+    if _enabled and usage is not None:
+        count("llm.prompt_tokens", getattr(usage, "prompt_tokens", 0) or 0)
+        count("llm.completion_tokens", getattr(usage, "completion_tokens", 0) or 0)
@@ -0,0 +1,117 @@
+import hashlib
+import json
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+
+import metrics
+
+
+def normalize_text(text: str) -> str:
+    """
+    归一化输入文本：去除首尾空白与空行，合并连续空白；
+    仅空白不同的两段粘贴内容会命中同一条缓存
+    """
+    lines = (re.sub(r"\s+", " ", line).strip() for line in text.splitlines())
+    return "\n".join(line for line in lines if line)
+
+
+class ParseCache:
+    """
+    LLM 解析结果缓存：
+    先查进程内 LRU，再查 sqlite 磁盘缓存；两级缓存均按 ttl（秒）过期，
+    内存最多保留 max_entries 条，磁盘最多保留 disk_max_entries 条（按最近访问淘汰）。
+    sqlite 使用 WAL 模式，多个 Streamlit worker 可共享同一个文件；path 为 None 时只使用内存缓存
+    """
+
+    def __init__(self, path: Optional[str] = None, max_entries: int = 256,
+                 disk_max_entries: int = 100_000, ttl: float = 30 * 24 * 3600,
+                 clock: Callable[[], float] = time.time) -> None:
+        self.max_entries = max_entries
+        self.disk_max_entries = disk_max_entries
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._memory: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        if path is not None:
+            self._db = sqlite3.connect(path, timeout=10, check_same_thread=False)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "key TEXT PRIMARY KEY, value TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            self._db.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+            self._db.commit()
+
+    @staticmethod
+    def key(kind: str, text: str, model: str, prompt_version: int, **extra) -> str:
+        """
+        由解析类型、归一化文本、模型名、提示词版本及其他参数（如 start_year）生成缓存键
+        """
+        payload = json.dumps(
+            [kind, normalize_text(text), model, prompt_version, sorted(extra.items())],
+            ensure_ascii=False,
+        )
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        now = self.clock()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                if now - entry[0] < self.ttl:
+                    self._memory.move_to_end(key)
+                    self.hits += 1
+                    metrics.count("cache.hit")
+                    return entry[1]
+                del self._memory[key]
+            if self._db is not None:
+                row = self._db.execute(
+                    "SELECT value, created FROM entries WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and now - row[1] < self.ttl:
+                    self._db.execute("UPDATE entries SET accessed = ? WHERE key = ?", (now, key))
+                    self._db.commit()
+                    self._remember(key, row[1], row[0])
+                    self.hits += 1
+                    metrics.count("cache.hit")
+                    return row[0]
+            self.misses += 1
+            metrics.count("cache.miss")
+            return None
+
+    def set(self, key: str, value: str) -> None:
+        now = self.clock()
+        with self._lock:
+            self._remember(key, now, value)
+            if self._db is not None:
+                self._db.execute(
+                    "INSERT OR REPLACE INTO entries (key, value, created, accessed) VALUES (?, ?, ?, ?)",
+                    (key, value, now, now),
+                )
+                self._db.execute("DELETE FROM entries WHERE created <= ?", (now - self.ttl,))
+                self._db.execute(
+                    "DELETE FROM entries WHERE key IN ("
+                    "SELECT key FROM entries ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                    (self.disk_max_entries,),
+                )
+                self._db.commit()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memory.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM entries")
+                self._db.commit()
+
+    def _remember(self, key: str, created: float, value: str) -> None:
+        self._memory[key] = (created, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
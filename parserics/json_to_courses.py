@@ -1,17 +1,191 @@
-from data import Course
-
-
-def json_to_courses(json_data):
-    courses = []
-    for item in json_data:
-        courses.append(
-            Course(
-                name=item["name"],
-                teacher=item["teacher"],
-                classroom=item["classroom"],
-                weekday=item["weekday"],
-                weeks=item["weeks"],
-                indexes=sorted(item["indexes"]),
-            )
-        )
-    return courses
+import re
+from dataclasses import dataclass, field
+from typing import Any, Optional
+
+import metrics
+from data import Course, WeekSet
+
+_INDEX_SEPARATORS = re.compile(r"[,，、\s]+")
+
+
+@dataclass
+class Ingested:
+    """
+    批量导入的结果：
+    courses 为通过校验的课程；errors 为被跳过的无效记录（含行号），
+    warnings 为重复记录（已去除）与同一班级内时间重叠的记录（保留）
+    """
+    courses: list[Course] = field(default_factory=list)
+    errors: list[str] = field(default_factory=list)
+    warnings: list[str] = field(default_factory=list)
+
+
+def _text(value: Any) -> Optional[str]:
+    if value is None:
+        return ""
+    return value if isinstance(value, str) else None
+
+
+def _int(value: Any) -> Optional[int]:
+    if isinstance(value, int) and not isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.strip().isdigit():
+        return int(value)
+    if isinstance(value, float) and value.is_integer():
+        # 数据编辑器（pandas）会把整数列转成浮点数
+        return int(value)
+    return None
+
+
+def _indexes(value: Any) -> Optional[list[int]]:
+    """
+    节次：整数数组，或 "1, 2" / "1-2" 这样的字符串
+    """
+    if isinstance(value, str):
+        result = []
+        for part in _INDEX_SEPARATORS.split(value.strip()):
+            if not part:
+                continue
+            bounds = part.split("-")
+            if len(bounds) > 2 or not all(b.isdigit() for b in bounds):
+                return None
+            result.extend(range(int(bounds[0]), int(bounds[-1]) + 1))
+        return result
+    if isinstance(value, (list, tuple)):
+        result = [_int(i) for i in value]
+        return None if None in result else result
+    return None
+
+
+def ingest(records: Any, periods: Optional[int] = None) -> Ingested:
+    """
+    一次性校验并规范化整批课程记录（json_to_courses 格式），不在第一个错误处停止：
+    检查字段类型、星期 1-7、节次范围（periods 为每天总节数，给出时检查上界）、周次记法，
+    去除完全相同的重复记录，并报告同一班级（group）中周次、星期、节次重叠的记录。
+    相同的周次字符串 / 数组只解析一次，十万行级别的导入也只需一次遍历
+    """
+    result = Ingested()
+    if not isinstance(records, list):
+        result.errors.append(f"课程数据应为数组，实际为 {type(records).__name__}")
+        return result
+    weeks_cache: dict[Any, Optional[WeekSet]] = {}
+    seen: dict[tuple, int] = {}
+    # (班级, 星期, 节次) -> [已占用周次的位图, {周次: 最先占用的行号}]，用于检测重叠；
+    # 每个 (时段, 周次) 只登记一次，重叠时只查找第一个重叠周次，耗时与记录数成线性
+    slots: dict[tuple, list] = {}
+    errors, warnings = result.errors, result.warnings
+
+    for row, item in enumerate(records, 1):
+        if not isinstance(item, dict):
+            errors.append(f"第 {row} 条：应为对象，实际为 {type(item).__name__}")
+            continue
+        problems = []
+        name = _text(item.get("name"))
+        if not name:
+            problems.append("缺少课程名（name）")
+        teacher, classroom, group = (_text(item.get(key)) for key in ("teacher", "classroom", "group"))
+        for key, value in (("teacher", teacher), ("classroom", classroom), ("group", group)):
+            if value is None:
+                problems.append(f"{key} 应为字符串")
+        weekday = _int(item.get("weekday"))
+        if weekday is None or not 1 <= weekday <= 7:
+            problems.append(f"星期（weekday）{item.get('weekday')!r} 不在 1-7 之间")
+
+        raw_weeks = item.get("weeks")
+        try:
+            weeks_key = tuple(raw_weeks) if isinstance(raw_weeks, list) else raw_weeks
+            weeks = weeks_cache[weeks_key] if weeks_key in weeks_cache else weeks_cache.setdefault(weeks_key, _weeks(raw_weeks))
+        except TypeError:
+            # 无法作为缓存键（如数组中混有对象），不缓存
+            weeks = _weeks(raw_weeks)
+        if weeks is None:
+            problems.append(f"周次（weeks）{raw_weeks!r} 无效，应为正整数数组或 1-16双 这样的范围")
+
+        indexes = _indexes(item.get("indexes"))
+        if not indexes:
+            problems.append(f"节次（indexes）{item.get('indexes')!r} 无效，应为正整数数组")
+        elif min(indexes) < 1 or (periods is not None and max(indexes) > periods):
+            bound = f"1-{periods}" if periods is not None else "正整数"
+            problems.append(f"节次（indexes）{indexes} 超出范围（{bound}）")
+        if problems:
+            errors.append(f"第 {row} 条（{name or '?'}）：" + "；".join(problems))
+            continue
+
+        indexes = sorted(set(indexes))
+        key = (name, teacher, classroom, group, weekday, weeks.mask, tuple(indexes))
+        if key in seen:
+            warnings.append(f"第 {row} 条与第 {seen[key]} 条完全相同，已忽略")
+            continue
+        seen[key] = row
+        overlaps = set()
+        for index in indexes:
+            slot = slots.get((group, weekday, index))
+            if slot is None:
+                slot = slots[(group, weekday, index)] = [0, {}]
+            taken, owners = slot
+            common = weeks.mask & taken
+            if common:
+                # 只查找第一个重叠周次的占用者，避免逐周遍历
+                overlaps.add(owners[(common & -common).bit_length() - 1])
+            for w in WeekSet.from_mask(weeks.mask & ~taken):
+                owners[w] = row
+            slot[0] = taken | weeks.mask
+        if overlaps:
+            rows = "、".join(map(str, sorted(overlaps)))
+            warnings.append(f"第 {row} 条（{name}）与第 {rows} 条的上课时间重叠")
+        result.courses.append(Course(
+            name=name,
+            teacher=teacher,
+            classroom=classroom,
+            weekday=weekday,
+            weeks=weeks,
+            indexes=indexes,
+            group=group,
+        ))
+    return result
+
+
+def _weeks(value: Any) -> Optional[WeekSet]:
+    """
+    周次可以是整数数组，也可以是 "1-16双" 这样的范围记法
+    """
+    try:
+        if isinstance(value, str):
+            weeks = WeekSet.parse(value)
+        elif isinstance(value, list) and all(_int(w) is not None for w in value):
+            weeks = WeekSet(_int(w) for w in value)
+        else:
+            return None
+    except ValueError:
+        return None
+    return weeks if weeks and 0 not in weeks else None
+
+
+def json_to_courses(json_data, periods=None):
+    """
+    将课程记录转换为 Course 列表；有无效记录时抛出 ValueError，列出全部错误及行号
+    """
+    with metrics.span("json_to_courses"):
+        result = ingest(json_data, periods)
+    if result.errors:
+        raise ValueError("课程数据有误：\n" + "\n".join(result.errors))
+    metrics.count("json_to_courses.courses", len(result.courses))
+    return result.courses
+
+
+def courses_to_json(courses):
+    """
+    json_to_courses 的逆操作，周次以整数数组表示
+    """
+    return [
+        {
+            "name": c.name,
+            "teacher": c.teacher,
+            "classroom": c.classroom,
+            "weekday": c.weekday,
+            "weeks": list(c.weeks),
+            "indexes": list(c.indexes),
+            **({"group": c.group} if c.group else {}),
+        }
+        for c in courses
+    ]
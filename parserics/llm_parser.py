@@ -1,30 +1,264 @@
+import asyncio
+import atexit
+import json
 import os
-from openai import OpenAI
+import queue
+import threading
+import weakref
+from concurrent.futures import Future
+from typing import TYPE_CHECKING, AsyncIterable, Coroutine, Iterator, Optional
 
+import metrics
+from parserics.cache import ParseCache
+from data import WeekSet
+from parserics.rule_parser import parse_rules, split_blocks
 
-def parse_timetable(raw_text, api_key):
-    api_key = (api_key or os.getenv("DASHSCOPE_API_KEY") or "").strip()
-    client = OpenAI(
-        api_key=api_key,
-        base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
+if TYPE_CHECKING:
+    from openai import AsyncOpenAI, OpenAI
+
+BASE_URL = "https://dashscope.aliyuncs.com/compatible-mode/v1"
+MODEL = "qwen-turbo"
+# 修改提示词后需递增，使旧的缓存结果失效
+PROMPT_VERSION = 2
+# 单次请求超时（秒）与失败重试次数，由 OpenAI 客户端负责执行
+TIMEOUT = 60
+MAX_RETRIES = 2
+# 长文本分块解析时每块的最大字符数与最大并发请求数
+CHUNK_CHARS = 2000
+CHUNK_CONCURRENCY = 4
+
+_clients: "dict[str, OpenAI]" = {}
+# 异步客户端的连接池绑定在事件循环上，按事件循环分别缓存；
+# 同步代码（如 web.py）通过 submit() / iter_sync() 在同一个常驻后台事件循环中运行协程，复用同一组连接
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, dict[str, AsyncOpenAI]]" = (
+    weakref.WeakKeyDictionary()
+)
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_lock = threading.Lock()
+
+
+def _api_key(api_key):
+    return (api_key or os.getenv("DASHSCOPE_API_KEY") or "").strip()
+
+
+def create_client(api_key):
+    """
+    返回按 API Key 复用的同步客户端（共享连接池）；
+    openai 在第一次创建客户端时才导入，只生成日历的场景不需要加载它
+    """
+    from openai import OpenAI
+
+    api_key = _api_key(api_key)
+    client = _clients.get(api_key)
+    if client is None:
+        client = _clients[api_key] = OpenAI(
+            api_key=api_key, base_url=BASE_URL, timeout=TIMEOUT, max_retries=MAX_RETRIES,
+        )
+    return client
+
+
+def create_async_client(api_key):
+    """
+    返回当前事件循环内按 API Key 复用的异步客户端
+    """
+    from openai import AsyncOpenAI
+
+    api_key = _api_key(api_key)
+    clients = _async_clients.setdefault(asyncio.get_running_loop(), {})
+    client = clients.get(api_key)
+    if client is None:
+        client = clients[api_key] = AsyncOpenAI(
+            api_key=api_key, base_url=BASE_URL, timeout=TIMEOUT, max_retries=MAX_RETRIES,
+        )
+    return client
+
+
+async def aclose_clients():
+    """
+    关闭当前事件循环中缓存的异步客户端；自行创建事件循环（如 asyncio.run）的调用方应在循环结束前调用
+    """
+    for client in _async_clients.pop(asyncio.get_running_loop(), {}).values():
+        await client.close()
+
+
+def _background_loop():
+    global _loop
+    with _loop_lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name="llm-loop", daemon=True).start()
+            atexit.register(_shutdown_loop, loop)
+            _loop = loop
+    return _loop
+
+
+def _shutdown_loop(loop):
+    if not loop.is_running():
+        return
+    try:
+        asyncio.run_coroutine_threadsafe(aclose_clients(), loop).result(timeout=5)
+    finally:
+        loop.call_soon_threadsafe(loop.stop)
+
+
+def submit(coro: Coroutine) -> Future:
+    """
+    在常驻后台事件循环中运行协程，返回 concurrent.futures.Future
+    """
+    return asyncio.run_coroutine_threadsafe(coro, _background_loop())
+
+
+def iter_sync(aiterable: AsyncIterable) -> Iterator:
+    """
+    在后台事件循环中消费异步迭代器，在调用方线程中逐项产出（Streamlit 只允许在脚本线程中更新界面）
+    """
+    items: queue.Queue = queue.Queue()
+    done = object()
+
+    async def pump():
+        try:
+            async for item in aiterable:
+                items.put((True, item))
+        except Exception as e:
+            items.put((False, e))
+        finally:
+            items.put(done)
+
+    future = submit(pump())
+    try:
+        while (entry := items.get()) is not done:
+            ok, value = entry
+            if not ok:
+                raise value
+            yield value
+    finally:
+        future.cancel()
+
+
+def _cached(cache, key, call):
+    """
+    先查缓存，未命中时调用 LLM；只缓存能解析为 JSON 的返回内容
+    """
+    if cache is None:
+        return call()
+    content = cache.get(key)
+    if content is not None:
+        return content
+    content = call()
+    if _cacheable(content):
+        cache.set(key, content)
+    return content
+
+
+def _cacheable(content):
+    try:
+        json.loads(content)
+    except (TypeError, ValueError):
+        return False
+    return True
+
+
+async def _acached(cache, key, call):
+    if cache is None:
+        return await call()
+    content = cache.get(key)
+    if content is not None:
+        return content
+    content = await call()
+    if _cacheable(content):
+        cache.set(key, content)
+    return content
+
+
+def _merge_courses(courses, content):
+    """
+    合并本地规则解析结果与 LLM 返回内容；LLM 输出无法解析时保留原始输出，由调用方展示错误
+    """
+    if not courses:
+        return content
+    try:
+        data = json.loads(content)
+    except ValueError:
+        return content
+    llm_courses = data["courses"] if isinstance(data, dict) and "courses" in data else data
+    return json.dumps({"courses": courses + list(llm_courses)}, ensure_ascii=False)
+
+
+def parse_timetable(raw_text, api_key, cache=None, client=None):
+    """
+    将课表文本解析为 {"courses": [...]} JSON 字符串：
+    先用本地规则解析常见的教务系统格式，只把规则无法解析的行交给 LLM；
+    cache 为 ParseCache 时先查缓存；client 可传入兼容 OpenAI 接口的客户端（测试时可传入替身）
+    """
+    courses, rest = parse_rules(raw_text)
+    if not courses:
+        rest = raw_text
+    if not rest.strip():
+        return json.dumps({"courses": courses}, ensure_ascii=False)
+    key = ParseCache.key("timetable", rest, MODEL, PROMPT_VERSION)
+    content = _cached(
+        cache, key,
+        lambda: _complete(client or create_client(api_key), _timetable_messages(rest)),
+    )
+    return _merge_courses(courses, content)
+
+
+async def aparse_timetable(raw_text, api_key, cache=None, client=None):
+    """
+    parse_timetable 的异步版本
+    """
+    courses, rest = parse_rules(raw_text)
+    if not courses:
+        rest = raw_text
+    if not rest.strip():
+        return json.dumps({"courses": courses}, ensure_ascii=False)
+    key = ParseCache.key("timetable", rest, MODEL, PROMPT_VERSION)
+    content = await _acached(
+        cache, key,
+        lambda: _acomplete(client or create_async_client(api_key), _timetable_messages(rest)),
     )
+    return _merge_courses(courses, content)
+
+
+def _complete(client, messages):
+    with metrics.span("llm.complete"):
+        completion = client.chat.completions.create(
+            model=MODEL,
+            messages=messages,
+            extra_body={"enable_thinking": False},
+        )
+    metrics.record_usage(getattr(completion, "usage", None))
+    # Qwen 返回格式与 OpenAI 兼容
+    return completion.choices[0].message.content
+
+
+async def _acomplete(client, messages):
+    with metrics.span("llm.complete"):
+        completion = await client.chat.completions.create(
+            model=MODEL,
+            messages=messages,
+            extra_body={"enable_thinking": False},
+        )
+    metrics.record_usage(getattr(completion, "usage", None))
+    return completion.choices[0].message.content
+
+
+def _timetable_messages(raw_text):
     prompt = f"""请从下列文本中提取所有课程记录。
 文本开始>>
 {raw_text}
 <<文本结束
     """
-    completion = client.chat.completions.create(
-        model="qwen-turbo",
-        messages=[
-            {"role": "system", "content": """你是一名严格输出 JSON 的机器人，只能输出json，不能输出其他内容。
+    return [
+        {"role": "system", "content": """你是一名严格输出 JSON 的机器人，只能输出json，不能输出其他内容。
 请遵守以下规则：
 1. 每条课程记录对应 **一次真实上课事件**（同一课程在不同星期或不同节次需拆成多条）。
 2. `weekday` 用阿拉伯数字：星期一→1，…，星期日→7。
 3. `indexes` 必须是升序整数数组；例：“3-4节”→[3,4]。
-4. `weeks` 要 **全部展开** 成整数数组：
-   • “[1-16]” → `[1,2,…,16]`
-   • “[2-16双]” → `[2,4,6,…,16]`
-   • “[1, 3, 5]” 原样提取 `[1,3,5]`
+4. `weeks` 用范围记法字符串，不要展开：
+   • “[1-16]” → `"1-16"`
+   • “[2-16双]” → `"2-16双"`
+   • “[1, 3, 5]” 原样提取 `"1, 3, 5"`
 5. 输出示例（请勿直接使用）：
 {
   "courses":[
@@ -34,20 +268,17 @@ def parse_timetable(raw_text, api_key):
       "classroom":"南216",
       "weekday":1,
       "indexes":[7,8],
-      "weeks":[1,2,3,4,5,6,7,8,9,10,11,12,13,14,15,16]
+      "weeks":"1-16"
     }
   ]
 }
              """},
-            {"role": "user", "content": prompt}
-        ],
-        extra_body={"enable_thinking": False},
-    )
-    # Qwen 返回格式与 OpenAI 兼容
-    return completion.choices[0].message.content
+        {"role": "user", "content": prompt},
+    ]
 
 
-def parse_adjustments(adjust_text: str, api_key: str, start_year: int) -> str:
+def parse_adjustments(adjust_text: str, api_key: str, start_year: int,
+                      cache: Optional[ParseCache] = None, client=None) -> str:
     """
     使用 LLM 将中文放假/调休公告解析为结构化 JSON。
     返回形如：
@@ -64,13 +295,30 @@ def parse_adjustments(adjust_text: str, api_key: str, start_year: int) -> str:
     - 所有日期均输出为 YYYY-MM-DD，年份优先使用 start_year；如公告明显跨年则据语义判断。
     - 只能输出 JSON，不得包含任何额外文字。
     """
-    api_key = (api_key or os.getenv("DASHSCOPE_API_KEY") or "").strip()
     if not adjust_text.strip():
         return "{}"
-    client = OpenAI(
-        api_key=api_key,
-        base_url="https://dashscope.aliyuncs.com/compatible-mode/v1",
+    key = ParseCache.key("adjustments", adjust_text, MODEL, PROMPT_VERSION, start_year=start_year)
+    return _cached(
+        cache, key,
+        lambda: _complete(client or create_client(api_key), _adjustments_messages(adjust_text, start_year)),
     )
+
+
+async def aparse_adjustments(adjust_text: str, api_key: str, start_year: int,
+                             cache: Optional[ParseCache] = None, client=None) -> str:
+    """
+    parse_adjustments 的异步版本
+    """
+    if not adjust_text.strip():
+        return "{}"
+    key = ParseCache.key("adjustments", adjust_text, MODEL, PROMPT_VERSION, start_year=start_year)
+    return await _acached(
+        cache, key,
+        lambda: _acomplete(client or create_async_client(api_key), _adjustments_messages(adjust_text, start_year)),
+    )
+
+
+def _adjustments_messages(adjust_text: str, start_year: int) -> list[dict]:
     prompt = f"""请将下面的中文放假/调休公告解析为 JSON：
 公告文本开始>>
 {adjust_text}
@@ -88,13 +336,217 @@ def parse_adjustments(adjust_text: str, api_key: str, start_year: int) -> str:
 4) 年份默认使用 {start_year}，如公告明确跨年则按实际年份输出；
 5) 只输出 JSON，无解释，无多余文字。
 """
-    completion = client.chat.completions.create(
-        model="qwen-turbo",
-        messages=[
-            {"role": "system", "content": "你是严格 JSON 解析器，只能输出 JSON。"},
-            {"role": "user", "content": prompt},
-        ],
+    return [
+        {"role": "system", "content": "你是严格 JSON 解析器，只能输出 JSON。"},
+        {"role": "user", "content": prompt},
+    ]
+
+
+async def aparse_all(raw_text, adjust_text, api_key, start_year, cache=None, client=None):
+    """
+    并发解析课表与调休公告，返回 (课表 JSON, 调休 JSON)；耗时取决于较慢的一个请求
+    """
+    return tuple(await asyncio.gather(
+        aparse_timetable(raw_text, api_key, cache, client),
+        aparse_adjustments(adjust_text, api_key, start_year, cache, client),
+    ))
+
+
+def parse_all(raw_text, adjust_text, api_key, start_year, cache=None, client=None):
+    """
+    aparse_all 的同步入口，供 web.py 等同步代码调用；在常驻后台事件循环中运行，复用连接池
+    """
+    return submit(aparse_all(raw_text, adjust_text, api_key, start_year, cache, client)).result()
+
+
+async def aparse_many(raw_texts, api_key, concurrency=8, cache=None, client=None):
+    """
+    批量解析多份课表，最多同时发出 concurrency 个请求；
+    返回与输入顺序一致的列表，单份失败时对应位置为异常对象，不影响其他课表
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(raw_text):
+        async with semaphore:
+            return await aparse_timetable(raw_text, api_key, cache, client)
+
+    return await asyncio.gather(*(one(t) for t in raw_texts), return_exceptions=True)
+
+
+
+class CourseStreamDecoder:
+    """
+    增量解析流式返回的 JSON：
+    逐段 feed 模型输出，每当数组中的一个课程对象完整到达就立即返回，
+    不必等待整段 JSON 结束；对象之外的内容（如 ```json 代码块标记）会被忽略
+    """
+
+    def __init__(self) -> None:
+        self.buffer = ""
+        self.stack: list[str] = []
+        self.in_string = False
+        self.escape = False
+        self.start: Optional[int] = None
+        self.pos = 0
+
+    def feed(self, text: str) -> list[dict]:
+        self.buffer += text
+        courses = []
+        buffer = self.buffer
+        for i in range(self.pos, len(buffer)):
+            ch = buffer[i]
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif ch == "\\":
+                    self.escape = True
+                elif ch == '"':
+                    self.in_string = False
+            elif ch == '"':
+                self.in_string = True
+            elif ch in "[{":
+                if ch == "{" and self.stack and self.stack[-1] == "[" and self.start is None:
+                    self.start = i
+                self.stack.append(ch)
+            elif ch in "]}" and self.stack:
+                self.stack.pop()
+                if ch == "}" and self.start is not None and self.stack and self.stack[-1] == "[":
+                    try:
+                        item = json.loads(buffer[self.start:i + 1])
+                    except ValueError:
+                        item = None
+                    if isinstance(item, dict) and "name" in item:
+                        courses.append(item)
+                    self.start = None
+        self.pos = len(buffer)
+        return courses
+
+
+def _strip_fence(content):
+    """
+    去掉模型偶尔附带的 ```json 代码块标记
+    """
+    content = content.strip()
+    if content.startswith("```"):
+        content = content.split("\n", 1)[1] if "\n" in content else ""
+        content = content.rsplit("```", 1)[0]
+    return content.strip()
+
+
+def _course_key(course):
+    weeks = course.get("weeks")
+    try:
+        weeks = str(WeekSet.parse(weeks) if isinstance(weeks, str) else WeekSet(weeks))
+    except (TypeError, ValueError):
+        weeks = repr(weeks)
+    try:
+        indexes = tuple(sorted(course.get("indexes") or []))
+    except TypeError:
+        indexes = repr(course.get("indexes"))
+    return (course.get("name"), course.get("teacher"), course.get("classroom"),
+            course.get("weekday"), indexes, weeks)
+
+
+async def _astream(client, messages):
+    stream = await client.chat.completions.create(
+        model=MODEL,
+        messages=messages,
+        stream=True,
+        # 流式响应默认不含 token 用量，需显式请求（用量在最后一个 choices 为空的分片中返回）
+        stream_options={"include_usage": True},
         extra_body={"enable_thinking": False},
     )
-    return completion.choices[0].message.content
+    async for chunk in stream:
+        # 部分兼容接口在最后一个分片中附带 token 用量
+        metrics.record_usage(getattr(chunk, "usage", None))
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+
+async def aiter_timetable(raw_text, api_key, cache=None, client=None,
+                          chunk_chars=CHUNK_CHARS, concurrency=CHUNK_CONCURRENCY):
+    """
+    分块、流式解析长课表文本：
+    本地规则能解析的课程最先产出；其余文本按课程分块并发交给 LLM，
+    每块以流式方式返回，课程对象一到达即产出。
+    产出 (courses, error)：courses 为新到达且去重后的课程列表，
+    error 为某一分块的输出无法解析时的说明（其余分块的结果不受影响），否则为 None
+    """
+    seen = set()
+
+    def fresh(courses):
+        result = []
+        for course in courses:
+            key = _course_key(course)
+            if key not in seen:
+                seen.add(key)
+                result.append(course)
+        return result
 
+    courses, rest = parse_rules(raw_text)
+    if not courses:
+        rest = raw_text
+    if courses:
+        yield fresh(courses), None
+    chunks = split_blocks(rest, chunk_chars) if rest.strip() else []
+    if not chunks:
+        return
+
+    client = client or create_async_client(api_key)
+    queue: asyncio.Queue = asyncio.Queue()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(chunk):
+        try:
+            async with semaphore:
+                key = ParseCache.key("timetable", chunk, MODEL, PROMPT_VERSION)
+                content = cache.get(key) if cache is not None else None
+                if content is not None:
+                    decoder = CourseStreamDecoder()
+                    await queue.put((decoder.feed(content), None))
+                    return
+                decoder, parts = CourseStreamDecoder(), []
+                with metrics.span("llm.stream"):
+                    async for delta in _astream(client, _timetable_messages(chunk)):
+                        parts.append(delta)
+                        found = decoder.feed(delta)
+                        if found:
+                            await queue.put((found, None))
+                content = _strip_fence("".join(parts))
+                if cache is not None and _cacheable(content):
+                    cache.set(key, content)
+                elif not _cacheable(content):
+                    await queue.put(([], f"以下分块的 LLM 输出不是完整 JSON，已保留其中可解析的课程：\n{chunk}\n\nLLM原始输出：\n{content}"))
+        except Exception as e:
+            await queue.put(([], f"以下分块解析失败：{e}\n{chunk}"))
+        finally:
+            await queue.put(None)
+
+    tasks = [asyncio.create_task(run(chunk)) for chunk in chunks]
+    pending = len(tasks)
+    try:
+        while pending:
+            item = await queue.get()
+            if item is None:
+                pending -= 1
+                continue
+            found, error = item
+            found = fresh(found)
+            if found or error:
+                yield found, error
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def aparse_timetable_chunked(raw_text, api_key, cache=None, client=None,
+                                   chunk_chars=CHUNK_CHARS, concurrency=CHUNK_CONCURRENCY):
+    """
+    分块并发解析后合并去重，返回与 parse_timetable 相同格式的 JSON 字符串与错误列表
+    """
+    courses, errors = [], []
+    async for found, error in aiter_timetable(raw_text, api_key, cache, client, chunk_chars, concurrency):
+        courses.extend(found)
+        if error:
+            errors.append(error)
+    return json.dumps({"courses": courses}, ensure_ascii=False), errors
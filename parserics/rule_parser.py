@@ -0,0 +1,246 @@
+"""
+基于规则的本地课表解析：
+处理教务系统导出的常见格式，无需调用 LLM。
+
+每行一条上课记录，如：
+    离散数学 舒少龙 星期一 第7-8节 [1-16周] 南216
+也支持先写课程名（和教师），再逐行列出上课时间的分块格式：
+    离散数学 舒少龙
+    星期一 第7-8节 [1-16周] 南216
+    星期三 第3-4节 [2-16双周] 南216
+
+无法可靠解析的行会原样返回，交给 LLM 处理。
+"""
+import re
+from typing import Optional
+
+from data import WeekSet
+
+WEEKDAYS = {"一": 1, "二": 2, "三": 3, "四": 4, "五": 5, "六": 6, "日": 7, "天": 7}
+
+_WEEKDAY = re.compile(r"(?:星期|周)([一二三四五六日天])|星期([1-7])")
+_PERIODS = re.compile(r"第?\s*(\d+(?:\s*[-~～,，、]\s*\d+)*)\s*节")
+_WEEKS = re.compile(
+    r"第?(\d[\d,，、\-~～\s]*?)\s*(?:[（(]?([单双])[)）]?)?\s*周\s*(?:[（(]([单双])[)）]|([单双])(?!\S))?"
+    r"|[\[【{]\s*(\d[\d,，、\-~～\s]*?)\s*([单双])?\s*[\]】}]"
+)
+_LABEL = re.compile(r"(教师|老师|任课教师|地点|教室|上课地点|课程|课程名称)[:：](.+)")
+_SEPARATORS = re.compile(r"[\s|｜/\t,，;；]+")
+_NOISE = "[]【】{}()（）<>《》"
+_DIGIT = re.compile(r"\d")
+_HEADER_CHARS = 20
+
+
+def _parse_periods(text: str) -> list[int]:
+    indexes = set()
+    for part in re.split(r"[,，、]", text):
+        bounds = [int(x) for x in re.split(r"[-~～]", part) if x.strip()]
+        if bounds:
+            indexes.update(range(bounds[0], bounds[-1] + 1))
+    return sorted(indexes)
+
+
+def _parse_weeks(m: re.Match) -> WeekSet:
+    if m.group(5) is not None:
+        numbers, parity = m.group(5), m.group(6)
+    else:
+        numbers, parity = m.group(1), m.group(2) or m.group(3) or m.group(4)
+    numbers = re.sub(r"\s+", "", numbers).strip(",，、")
+    return WeekSet.parse(numbers + (parity or ""))
+
+
+def _tokens(text: str) -> list[str]:
+    tokens = (t.strip(_NOISE) for t in _SEPARATORS.split(text))
+    return [t for t in tokens if t]
+
+
+def _fields(tokens: list[str]) -> tuple[dict, list[str]]:
+    """
+    拆出带标签的字段（如 教师：张三），返回 (字段, 其余文本)
+    """
+    fields, rest = {}, []
+    for token in tokens:
+        m = _LABEL.fullmatch(token)
+        if m is None:
+            rest.append(token)
+            continue
+        label = m.group(1)
+        key = "teacher" if "师" in label else "classroom" if label in ("地点", "教室", "上课地点") else "name"
+        fields[key] = m.group(2)
+    return fields, rest
+
+
+def parse_line(line: str, header: Optional[dict] = None) -> Optional[dict]:
+    """
+    解析单行上课记录，header 为分块格式中前一行给出的课程名/教师，
+    只有行首即为上课时间（没有自己的课程名）的行才沿用；
+    无法可靠解析时返回 None
+    """
+    if header and not _inherits_header(line):
+        header = None
+    weekday = _WEEKDAY.search(line)
+    periods = _PERIODS.search(line)
+    if weekday is None or periods is None:
+        return None
+    weeks = None
+    spans = [weekday.span(), periods.span()]
+    for m in _WEEKS.finditer(line):
+        if any(m.start() < end and start < m.end() for start, end in spans):
+            continue
+        try:
+            weeks = _parse_weeks(m)
+        except ValueError:
+            return None
+        spans.append(m.span())
+        break
+    indexes = _parse_periods(periods.group(1))
+    if not weeks or not indexes:
+        return None
+
+    first = min(start for start, _ in spans)
+    last = max(end for _, end in spans)
+    between = line[first:last]
+    for start, end in sorted(spans, reverse=True):
+        between = between[:start - first] + " " + between[end - first:]
+    if _tokens(between):
+        return None
+    before_fields, before = _fields(_tokens(line[:first]))
+    after_fields, after = _fields(_tokens(line[last:]))
+    header = header or {}
+    name = before_fields.get("name") or after_fields.get("name") or (before[0] if before else header.get("name"))
+    if before and name == before[0]:
+        before = before[1:]
+    teacher = (before_fields.get("teacher") or after_fields.get("teacher")
+               or (before[0] if before else None) or header.get("teacher"))
+    if before and teacher == before[0]:
+        before = before[1:]
+    classroom = before_fields.get("classroom") or after_fields.get("classroom")
+    # 时间之后只允许一个无标签的字段（教室）；多个无标签字段无法区分教师与教室，交给 LLM
+    if classroom is None and len(after) == 1:
+        classroom, after = after[0], []
+    if not name or before or after:
+        return None
+    return {
+        "name": name,
+        "teacher": teacher or "",
+        "classroom": classroom or header.get("classroom") or "",
+        "weekday": WEEKDAYS[weekday.group(1)] if weekday.group(1) else int(weekday.group(2)),
+        "indexes": indexes,
+        "weeks": str(weeks),
+    }
+
+
+def _is_header(line: str) -> bool:
+    return not (_WEEKDAY.search(line) or _PERIODS.search(line) or _WEEKS.search(line))
+
+
+def _header_fields(line: str) -> Optional[dict]:
+    """
+    分块标题行的课程名 / 教师：只接受一至两个不含数字的短字段（可带 课程：/ 教师： 标签），
+    如 "2025-2026学年第二学期 个人课表" 这类导出标题不是课程标题，返回 None
+    """
+    fields, tokens = _fields(_tokens(line))
+    values = tokens + list(fields.values())
+    if not values or len(tokens) > 2 or any(len(v) > _HEADER_CHARS or _DIGIT.search(v) for v in values):
+        return None
+    name = fields.get("name") or (tokens[0] if tokens else None)
+    if name is None:
+        return None
+    return {
+        "name": name,
+        "teacher": fields.get("teacher") or (tokens[1] if len(tokens) > 1 else None),
+        "classroom": fields.get("classroom"),
+    }
+
+
+def _inherits_header(line: str) -> bool:
+    """
+    行首即为上课时间（没有自己的课程名）的行，依赖分块标题行提供课程名
+    """
+    starts = [m.start() for m in (_WEEKDAY.search(line), _PERIODS.search(line)) if m is not None]
+    return not _tokens(line[:min(starts, default=0)])
+
+
+def parse_rules(raw_text: str) -> tuple[list[dict], str]:
+    """
+    逐行解析课表文本，返回 (courses, 未能解析的文本)：
+    courses 与 LLM 输出的 courses 格式相同；每个非空行要么被解析，要么原样（按原顺序）返回以交给 LLM。
+    标题行只有在其后至少一行借助它解析成功时才算已解析；
+    未能解析的行连同其所属分块的标题行一并返回
+    """
+    courses, rest = [], []
+    lines = [line.strip() for line in raw_text.splitlines()]
+    lines = [line for line in lines if line]
+    parsed = 0
+    header, header_line, header_pos, header_used, header_sent = None, "", 0, False, False
+
+    def close_header() -> None:
+        # 没有被任何一行用上的标题行也交给 LLM，插回它原来的位置
+        nonlocal parsed
+        if not header_line or header_sent:
+            return
+        if header_used:
+            parsed += 1
+        else:
+            rest.insert(header_pos, header_line)
+
+    for line in lines:
+        if _is_header(line):
+            close_header()
+            header = _header_fields(line)
+            header_line, header_pos, header_used, header_sent = line, len(rest), False, False
+            continue
+        inherits = _inherits_header(line)
+        course = parse_line(line, header)
+        if course is not None:
+            courses.append(course)
+            parsed += 1
+            header_used = header_used or (header is not None and inherits)
+            continue
+        if header_line and not header_sent and inherits:
+            rest.insert(header_pos, header_line)
+            header_sent = True
+        rest.append(line)
+    close_header()
+    assert parsed + len(rest) == len(lines), "规则解析丢失了部分行"
+    return courses, "\n".join(rest)
+
+
+def split_blocks(raw_text: str, max_chars: int = 2000) -> list[str]:
+    """
+    按课程分块切分长文本，每块不超过 max_chars 个字符（单行超长时除外）：
+    空行与标题行开始新的分块；分块本身超长时按行拆开，并在后续各段重复标题行以保留课程名
+    """
+    blocks, current = [], []
+    for line in raw_text.splitlines():
+        line = line.strip()
+        if not line or _is_header(line):
+            if current:
+                blocks.append(current)
+                current = []
+            if not line:
+                continue
+        current.append(line)
+    if current:
+        blocks.append(current)
+
+    pieces = []
+    for block in blocks:
+        header = block[0] if _is_header(block[0]) else None
+        piece = []
+        for line in block:
+            if piece and len("\n".join(piece + [line])) > max_chars:
+                pieces.append("\n".join(piece))
+                piece = [header] if header else []
+            piece.append(line)
+        pieces.append("\n".join(piece))
+
+    chunks, chunk = [], ""
+    for piece in pieces:
+        if chunk and len(chunk) + 1 + len(piece) > max_chars:
+            chunks.append(chunk)
+            chunk = ""
+        chunk = f"{chunk}\n{piece}" if chunk else piece
+    if chunk:
+        chunks.append(chunk)
+    return chunks
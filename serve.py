@@ -0,0 +1,241 @@
+"""
+日历订阅服务：
+将目录中的课表定义（格式同 batch.py，每个 *.json 一份，或预编译的 *.ttc）预先渲染为 .ics 并缓存在内存中，
+通过 http://<host>:<port>/<名称>.ics 提供订阅（webcal://），
+支持强 ETag、If-None-Match / If-Modified-Since 条件请求（返回 304）和 gzip 压缩；
+后台线程定期检查定义文件，有变化时才重新生成。
+
+用法：
+python serve.py timetables/ --schools schools.json --port 8000
+"""
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass
+from email.utils import formatdate, parsedate_to_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Optional
+from urllib.parse import unquote, urlparse
+
+import compiled
+from batch import build_school
+from data import EventIndex
+
+
+@dataclass
+class Rendered:
+    body: bytes
+    gzipped: bytes
+    etag: str
+    last_modified: float
+
+    @property
+    def gzip_etag(self) -> str:
+        # 强校验器必须随内容编码不同而不同，gzip 版本使用单独的 ETag
+        return self.etag[:-1] + '-gz"'
+
+
+def accepts_gzip(accept_encoding: str) -> bool:
+    """
+    按 Accept-Encoding 判断客户端是否接受 gzip：gzip;q=0 表示拒绝，未列出 gzip 时参考 *
+    """
+    qualities = {}
+    for item in accept_encoding.split(","):
+        coding, _, params = item.partition(";")
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.partition("=")
+            if key.strip().lower() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        qualities[coding.strip().lower()] = q
+    for coding in ("gzip", "x-gzip", "*"):
+        if coding in qualities:
+            return qualities[coding] > 0
+    return False
+
+
+class CalendarStore:
+    """
+    预渲染的日历缓存：
+    以定义文件的 (mtime, size) 判断是否需要重新生成；每份日历保留一个 EventIndex，
+    定义未实质变化时输出逐字节相同，ETag 与 Last-Modified 保持不变
+    """
+
+    def __init__(self, directory: str, schools: Optional[dict] = None, interval: float = 5.0) -> None:
+        self.directory = directory
+        self.schools = schools or {}
+        self.interval = interval
+        self._calendars: dict[str, Rendered] = {}
+        self._stats: dict[str, tuple[float, int]] = {}
+        self._indexes: dict[str, EventIndex] = {}
+        self._files: dict[str, str] = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def get(self, name: str) -> Optional[Rendered]:
+        with self._lock:
+            return self._calendars.get(name)
+
+    def refresh(self) -> list[str]:
+        """
+        重新生成有变化的日历，移除已删除的定义；返回重新生成的名称列表
+        """
+        current = {}
+        self._files = {}
+        for file in os.listdir(self.directory):
+            name, ext = os.path.splitext(file)
+            if ext in (".json", ".ttc"):
+                st = os.stat(os.path.join(self.directory, file))
+                current[name] = (st.st_mtime, st.st_size)
+                self._files[name] = file
+        updated = []
+        for name, stat in current.items():
+            if self._stats.get(name) == stat:
+                continue
+            self._stats[name] = stat
+            try:
+                self._render(name)
+            except Exception as e:
+                # 保留上一次成功生成的内容
+                print(f"[失败] {name}: {type(e).__name__}: {e}")
+                continue
+            updated.append(name)
+        with self._lock:
+            for name in set(self._calendars) - set(current):
+                del self._calendars[name]
+        for name in set(self._stats) - set(current):
+            del self._stats[name]
+            self._indexes.pop(name, None)
+        return updated
+
+    def _render(self, name: str) -> None:
+        path = os.path.join(self.directory, self._files[name])
+        if path.endswith(".ttc"):
+            school = compiled.load(path)
+        else:
+            with open(path, encoding="utf-8") as f:
+                school = build_school(json.load(f), self.schools)
+        index = self._indexes.setdefault(name, EventIndex())
+        body = school.generate(index).encode("utf-8")
+        etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+        with self._lock:
+            previous = self._calendars.get(name)
+            if previous is not None and previous.etag == etag:
+                return
+            self._calendars[name] = Rendered(body, gzip.compress(body, mtime=0), etag, time.time())
+
+    def start(self) -> None:
+        self.refresh()
+        self._thread = threading.Thread(target=self._watch, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _watch(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.refresh()
+
+
+class SubscriptionHandler(BaseHTTPRequestHandler):
+    store: CalendarStore
+
+    def do_HEAD(self) -> None:
+        self._serve(head=True)
+
+    def do_GET(self) -> None:
+        self._serve(head=False)
+
+    def _serve(self, head: bool) -> None:
+        path = unquote(urlparse(self.path).path).lstrip("/")
+        calendar = self.store.get(path[:-len(".ics")]) if path.endswith(".ics") else None
+        if calendar is None:
+            self.send_error(404)
+            return
+        gzipped = accepts_gzip(self.headers.get("Accept-Encoding", ""))
+        if self._not_modified(calendar):
+            self.send_response(304)
+            self.send_header("Vary", "Accept-Encoding")
+            self._send_validators(calendar, gzipped)
+            self.end_headers()
+            return
+        body = calendar.gzipped if gzipped else calendar.body
+        self.send_response(200)
+        self.send_header("Content-Type", "text/calendar; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Vary", "Accept-Encoding")
+        if gzipped:
+            self.send_header("Content-Encoding", "gzip")
+        self._send_validators(calendar, gzipped)
+        self.end_headers()
+        if not head:
+            self.wfile.write(body)
+
+    def _not_modified(self, calendar: Rendered) -> bool:
+        if_none_match = self.headers.get("If-None-Match")
+        if if_none_match is not None:
+            # If-None-Match 优先于 If-Modified-Since
+            tags = [t.strip() for t in if_none_match.split(",")]
+            current = (calendar.etag, calendar.gzip_etag)
+            return "*" in tags or any(t.removeprefix("W/") in current for t in tags)
+        if_modified_since = self.headers.get("If-Modified-Since")
+        if if_modified_since is not None:
+            try:
+                since = parsedate_to_datetime(if_modified_since).timestamp()
+            except (TypeError, ValueError):
+                return False
+            return int(calendar.last_modified) <= since
+        return False
+
+    def _send_validators(self, calendar: Rendered, gzipped: bool) -> None:
+        self.send_header("ETag", calendar.gzip_etag if gzipped else calendar.etag)
+        self.send_header("Last-Modified", formatdate(calendar.last_modified, usegmt=True))
+        self.send_header("Cache-Control", "no-cache")
+
+    def log_message(self, format: str, *args) -> None:
+        # 订阅客户端轮询频繁，不逐条打印访问日志
+        pass
+
+
+def make_server(store: CalendarStore, host: str = "127.0.0.1", port: int = 8000) -> ThreadingHTTPServer:
+    handler = type("Handler", (SubscriptionHandler,), {"store": store})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="提供 .ics 日历订阅服务")
+    parser.add_argument("directory", help="课表定义目录（*.json）")
+    parser.add_argument("--schools", help="学校设置 JSON 文件：{键名: 设置}")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--interval", type=float, default=5.0, help="检查定义文件变化的间隔（秒）")
+    args = parser.parse_args()
+    schools = {}
+    if args.schools:
+        with open(args.schools, encoding="utf-8") as f:
+            schools = json.load(f)
+    store = CalendarStore(args.directory, schools, args.interval)
+    store.start()
+    server = make_server(store, args.host, args.port)
+    print(f"订阅地址：webcal://{args.host}:{args.port}/<名称>.ics")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        store.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,110 @@
 import streamlit as st
 import json
-from parserics.llm_parser import parse_timetable, parse_adjustments
-from parserics.json_to_courses import json_to_courses
-from data import School
+import os
+from contextlib import nullcontext
+import metrics
+from parserics.cache import ParseCache
+from parserics.llm_parser import aiter_timetable, aparse_adjustments, iter_sync, submit
+from parserics.json_to_courses import courses_to_json, ingest, json_to_courses
+from data import Adjustments, EventIndex, School, WeekSet
 import datetime
 
 st.set_page_config(page_title="大学生课表转ICS日历", page_icon="📅", layout="centered")
 
+
+@st.cache_resource
+def get_parse_cache():
+    # 进程内共享，多个 worker 通过同一个 sqlite 文件共享磁盘缓存
+    return ParseCache(os.getenv("LLM_CACHE_PATH", "llm_cache.sqlite"))
+
+
+# Streamlit 每次交互都会从头重跑脚本，以下各阶段按输入缓存，输入不变时直接复用结果
+@st.cache_data(max_entries=32)
+def editor_rows(course_list):
+    """
+    课程列表 -> 数据编辑器的行：周次、节次转为字符串（周次使用 1-16双 这样的范围记法）；
+    st.cache_data 每次返回副本，不会改动原始数据
+    """
+    rows = []
+    for course in course_list:
+        row = dict(course)
+        if isinstance(row.get('weeks'), list):
+            row['weeks'] = str(WeekSet(row['weeks']))
+        if isinstance(row.get('indexes'), list):
+            row['indexes'] = ", ".join(map(str, row['indexes']))
+        rows.append(row)
+    return rows
+
+
+@st.cache_data(max_entries=32)
+def parse_rows(records, periods):
+    """
+    数据编辑器的行 -> 课程列表，一次校验全部行，返回 (课程列表, 错误信息, 提示信息)；
+    周次、节次字符串由 ingest 统一解析，完全相同的重复行会被去除
+    """
+    result = ingest(records, periods)
+    if result.errors:
+        return None, "以下课程记录有误，请修改后再生成：\n\n" + "\n\n".join(result.errors), result.warnings
+    return courses_to_json(result.courses), None, result.warnings
+
+
+@st.cache_data(max_entries=32)
+def load_courses(course_list):
+    return json_to_courses(course_list)
+
+
+@st.cache_resource(max_entries=64)
+def compile_adjustments(adjustments_json):
+    # Adjustments 不可变，可在会话间共享同一个对象
+    return Adjustments.compile(json.loads(adjustments_json))
+
+
+def render_ics(course_list, timetable, start, duration, adjustments, compact, timezone):
+    """
+    构建 School 并生成 ICS，返回 (ICS 文本, 调休错误)；
+    结果按输入保存在会话中，未修改任何内容时再次点击生成直接复用。
+    School 与 EventIndex 都是可变对象，只在会话内缓存，不跨会话共享
+    """
+    adjustments_json = json.dumps(adjustments, ensure_ascii=False, sort_keys=True)
+    key = (json.dumps(course_list, ensure_ascii=False, sort_keys=True, default=str),
+           tuple(timetable), start, duration, adjustments_json, compact, timezone)
+    cached = st.session_state.get("rendered")
+    if cached is not None and cached[0] == key:
+        return cached[1]
+    school = School(
+        duration=duration,
+        timetable=list(timetable),
+        start=start,
+        courses=load_courses(course_list),
+        adjustments=compile_adjustments(adjustments_json),
+        compact=compact,
+        timezone=timezone,
+    )
+    # 同一会话中重复生成时，未修改的日历项保持 DTSTAMP / SEQUENCE 不变
+    index = st.session_state.setdefault("event_index", EventIndex())
+    result = (school.generate(index), school.adjustment_errors)
+    st.session_state["rendered"] = (key, result)
+    return result
+
+
+def parse_progressively(raw_text, adjust_text, api_key, start_year, preview):
+    """
+    流式解析课表并逐步刷新预览表格，同时并发解析调休公告；
+    返回 (课程列表, 分块错误列表, 调休 JSON 字符串)。
+    协程在 llm_parser 的常驻后台事件循环中运行，每次点击复用同一组异步客户端与连接池
+    """
+    cache = get_parse_cache()
+    adjustments = submit(aparse_adjustments(adjust_text, api_key, start_year, cache=cache))
+    course_list, errors = [], []
+    for found, error in iter_sync(aiter_timetable(raw_text, api_key, cache=cache)):
+        course_list.extend(found)
+        if error:
+            errors.append(error)
+        if found:
+            preview.dataframe(course_list, use_container_width=True)
+    return course_list, errors, adjustments.result()
+
+
 # 顶部导航栏/链接
 st.markdown("""
 <div style='display: flex; justify-content: flex-end; align-items: center; margin-bottom: 0.5em;'>
@@ -52,6 +150,8 @@ adjust_text = st.text_area(
 )
 
 apply_adjustments = st.checkbox("启用调休规则", value=True, help="关闭后将忽略放假/调休规则")
+compact = st.checkbox("紧凑输出（循环事件）", value=False, help="每门课程只生成一个每周重复的日历项，文件更小、导入更快")
+timezone = st.text_input("时区", value="Asia/Shanghai", help="IANA 时区名（如 America/New_York）；填 UTC 使用 UTC 时间，填 floating 则不带时区，按设备本地时间显示")
 
 st.divider()
 
@@ -104,30 +204,30 @@ if st.button("解析课表") and raw:
         api_key_to_use = st.secrets.get("PUBLIC_API_KEY", "")
     else:
         api_key_to_use = api_key
-    with st.spinner("正在调用 LLM 解析课表..."):
-        json_str = parse_timetable(raw, api_key_to_use)
-        try:
-            json_data = json.loads(json_str)
-            if isinstance(json_data, dict) and "courses" in json_data:
-                course_list = json_data["courses"]
-            else:
-                course_list = json_data
-            st.session_state["course_list"] = course_list
-            st.success("解析成功！请在下方预览课表，确认无误后生成ICS文件。")
-        except Exception as e:
-            st.error(f"解析 LLM 返回内容失败: {e}\n\nLLM原始输出：\n{json_str}")
-            st.stop()
+    preview = st.empty()
+    with st.spinner("正在调用 LLM 解析课表与放假/调休公告..."):
+        # 课表按课程分块流式解析，已解析出的课程先显示；调休公告同时解析
+        course_list, errors, adj_str = parse_progressively(
+            raw, adjust_text, api_key_to_use, start_date.year, preview
+        )
+    preview.empty()
+    if errors and not course_list:
+        st.error("解析 LLM 返回内容失败：\n\n" + "\n\n".join(errors))
+        st.stop()
+    for error in errors:
+        st.warning(error)
+    st.session_state["course_list"] = course_list
+    st.success("解析成功！请在下方预览课表，确认无误后生成ICS文件。")
 
-    # 若提供了调休公告，尝试解析
+    # 若提供了调休公告，应用其解析结果
     if adjust_text.strip():
-        with st.spinner("正在解析放假/调休公告..."):
-            adj_str = parse_adjustments(adjust_text, api_key_to_use, start_date.year)
-            try:
+        try:
+            with metrics.span("web.json_decode"):
                 adj_data = json.loads(adj_str) if adj_str.strip() else {}
-            except Exception as e:
-                st.warning(f"调休公告解析失败（将不应用调休）：{e}\n\n原始输出：\n{adj_str}")
-                adj_data = {}
-            st.session_state["adjustments"] = adj_data
+        except Exception as e:
+            st.warning(f"调休公告解析失败（将不应用调休）：{e}\n\n原始输出：\n{adj_str}")
+            adj_data = {}
+        st.session_state["adjustments"] = adj_data
 
 if st.session_state["show_qr"]:
     with st.expander("感谢支持！如觉得本工具有用欢迎扫码赞赏（可关闭继续使用）", expanded=True):
@@ -138,16 +238,7 @@ if st.session_state["show_qr"]:
 if "course_list" in st.session_state:
     st.subheader("课表预览（可在此处修改）")
 
-    # Create a deep copy for editing to avoid altering the original data
-    import copy
-    editable_course_list = copy.deepcopy(st.session_state["course_list"])
-
-    # Convert list-like columns to comma-separated strings for st.data_editor
-    for course in editable_course_list:
-        if 'weeks' in course and isinstance(course['weeks'], list):
-            course['weeks'] = ", ".join(map(str, course['weeks']))
-        if 'indexes' in course and isinstance(course['indexes'], list):
-            course['indexes'] = ", ".join(map(str, course['indexes']))
+    editable_course_list = editor_rows(st.session_state["course_list"])
 
     edited_records = st.data_editor(
         editable_course_list,
@@ -164,19 +255,12 @@ if "course_list" in st.session_state:
         edited_records = edited_records.to_dict("records")
     elif isinstance(edited_records, dict):
         edited_records = [edited_records]
-    for record in edited_records:
-        if 'weeks' in record and isinstance(record['weeks'], str):
-            try:
-                record['weeks'] = [int(x.strip()) for x in record['weeks'].split(',') if x.strip()]
-            except ValueError:
-                st.error(f"课程 '{record.get('name', '')}' 的周次（weeks）格式不正确，请使用逗号分隔的数字。")
-                st.stop()
-        if 'indexes' in record and isinstance(record['indexes'], str):
-            try:
-                record['indexes'] = [int(x.strip()) for x in record['indexes'].split(',') if x.strip()]
-            except ValueError:
-                st.error(f"课程 '{record.get('name', '')}' 的节次（indexes）格式不正确，请使用逗号分隔的数字。")
-                st.stop()
+    edited_records, error, notices = parse_rows(edited_records, num_periods)
+    if error:
+        st.error(error)
+        st.stop()
+    for notice in notices:
+        st.warning(notice)
 
     st.session_state["course_list"] = edited_records
 
@@ -198,19 +282,34 @@ if "course_list" in st.session_state:
                 except Exception as e:
                     st.error(f"手动覆盖JSON解析失败：{e}")
 
+    # 设置 TIMETABLE_METRICS=1 启动时显示性能指标，并可为单次生成采集 cProfile / tracemalloc 快照
+    profile_kind = None
+    if metrics.enabled():
+        profile_kind = st.selectbox("为本次生成采集性能快照", [None, "cprofile", "tracemalloc"],
+                                    format_func=lambda k: k or "不采集")
+
     if st.button("确认无误，生成ICS文件"):
-        courses = json_to_courses(st.session_state["course_list"])
         try:
-            school = School(
-                duration=duration,
-                timetable=timetable,
-                start=(start_date.year, start_date.month, start_date.day),
-                courses=courses,
-                adjustments=st.session_state.get("adjustments", {}) if apply_adjustments else {},
-            )
-            ics_content = school.generate()
+            with metrics.profile(profile_kind) if profile_kind else nullcontext() as snapshot:
+                ics_content, adjustment_errors = render_ics(
+                    st.session_state["course_list"],
+                    tuple(timetable),
+                    (start_date.year, start_date.month, start_date.day),
+                    duration,
+                    st.session_state.get("adjustments", {}) if apply_adjustments else {},
+                    compact,
+                    timezone.strip(),
+                )
         except ValueError as e:
             st.error(str(e))
         else:
+            for error in adjustment_errors:
+                st.warning(f"已忽略无效的调休条目：{error}")
             st.success("ICS文件已生成！")
             st.download_button("下载ICS文件", ics_content, file_name="timetable.ics")
+            if snapshot:
+                st.code(snapshot["report"])
+
+if metrics.enabled():
+    with st.expander("性能指标", expanded=False):
+        st.json({k: v for k, v in metrics.snapshot().items() if k != "profiles"})